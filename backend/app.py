@@ -1,12 +1,13 @@
 #app.py
 
-from flask import Flask
+from quart import Quart
 from routes.text_processing import text_processing_bp
 from config import Config
-from flask_cors import CORS
+from quart_cors import cors
+import re
 
-app = Flask(__name__)
-CORS(app, supports_credentials=True)
+app = Quart(__name__)
+app = cors(app, allow_origin=re.compile(r".*"), allow_credentials=True)
 app.config.from_object(Config)
 
 # Register the blueprint for text processing
@@ -1,22 +1,20 @@
-# Asgi file to run the flask app using uvicorn server
-from asgiref.wsgi import WsgiToAsgi
+# Asgi file to run the quart app using uvicorn server
 import uvicorn
 
-# flask app imports
-from flask import Flask
+# quart app imports
+from quart import Quart
 from config import Config
-from flask_cors import CORS
-
-from flask_limiter import Limiter
-from flask_limiter.util import get_remote_address
-
-from flask_sqlalchemy import SQLAlchemy
+from quart_cors import cors
+import re
 
 # blueprint imports
 from routes.text_processing import text_processing_bp
 from routes.user import user_bp
 from routes.main import main_bp
 
+from services.database import connect_mongo, close_mongo
+from utils.decorators import start_certificate_prefetch, stop_certificate_prefetch
+
 from dotenv import load_dotenv
 import os
 
@@ -25,12 +23,13 @@ def create_app():
 
     load_dotenv()
 
-    app = Flask(__name__)
-    CORS(app, supports_credentials=True, allow_headers="*")
-
-    limiter = Limiter(
+    app = Quart(__name__)
+    # reflect any origin, credentials cannot be combined with a "*" origin
+    app = cors(
         app,
-        default_limits=["1 per minute"],
+        allow_origin=re.compile(r".*"),
+        allow_headers="*",
+        allow_credentials=True,
     )
 
     # Register the blueprint for text processing
@@ -38,11 +37,28 @@ def create_app():
 
     app.register_blueprint(text_processing_bp, url_prefix="/process-text")
 
+    # one mongo pool per worker, opened (with indexes checked) at startup
+    app.before_serving(connect_mongo)
+    app.after_serving(close_mongo)
+
+    # google signing certs are kept warm in the background
+    app.before_serving(start_certificate_prefetch)
+    app.after_serving(stop_certificate_prefetch)
+
     return app
 
 
 app = create_app()
-asgi_app = WsgiToAsgi(app)
+
+# kept for deployments that still point at asgi:asgi_app
+asgi_app = app
 
 if __name__ == "__main__":
-    uvicorn.run(asgi_app, host="0.0.0.0", port=3000, log_level="info")
+    # with several workers uvicorn needs the app as an import string
+    uvicorn.run(
+        "asgi:app",
+        host="0.0.0.0",
+        port=3000,
+        workers=Config.WORKERS,
+        log_level="info",
+    )
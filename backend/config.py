@@ -9,3 +9,107 @@ load_dotenv()
 class Config:
     API_KEY = os.getenv("API_KEY")
     DEBUG = True
+
+    # uvicorn worker processes started by asgi.py
+    WORKERS = int(os.getenv("WORKERS", 1))
+
+    # connection pool of the shared mongo client, per worker
+    MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", 100))
+    MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", 0))
+
+    # embedding backend used by /process-text/text: gemini, hashing or sentence-transformers
+    EMBEDDING_PROVIDER = os.getenv("EMBEDDING_PROVIDER", "gemini")
+    # optional model override for the selected embedding backend
+    EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL")
+
+    # sentence embedding cache: in-process LRU entries, redis TTL and packed dtype
+    EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", 5_000))
+    EMBEDDING_CACHE_TTL = int(os.getenv("EMBEDDING_CACHE_TTL", 60 * 60 * 24 * 7))
+    EMBEDDING_CACHE_DTYPE = os.getenv("EMBEDDING_CACHE_DTYPE", "float16")
+
+    # embedding batches in flight per request, and retries on 429/5xx
+    EMBEDDING_CONCURRENCY = int(os.getenv("EMBEDDING_CONCURRENCY", 8))
+    EMBEDDING_RETRIES = int(os.getenv("EMBEDDING_RETRIES", 3))
+
+    # seconds before a text analysis call to the LLM is abandoned
+    LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", 60))
+
+    # chunked analysis of long texts: estimated tokens per chunk, chunks in
+    # flight per request, and retries of a failed chunk
+    LLM_CHUNK_TOKENS = int(os.getenv("LLM_CHUNK_TOKENS", 4000))
+    LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", 4))
+    LLM_RETRIES = int(os.getenv("LLM_RETRIES", 2))
+
+    # sentence segmentation: nlp.pipe batch size, and processes used for inputs
+    # of at least SENTENCIZER_MULTIPROCESS_CHARS characters
+    SENTENCIZER_BATCH_SIZE = int(os.getenv("SENTENCIZER_BATCH_SIZE", 16))
+    SENTENCIZER_PROCESSES = int(os.getenv("SENTENCIZER_PROCESSES", 1))
+    SENTENCIZER_MULTIPROCESS_CHARS = int(
+        os.getenv("SENTENCIZER_MULTIPROCESS_CHARS", 500_000)
+    )
+
+    # verified firebase tokens kept in memory per worker (each until its exp),
+    # and how long before the signing certs expire they are refetched (seconds)
+    AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", 10_000))
+    AUTH_CERT_REFRESH_MARGIN = float(os.getenv("AUTH_CERT_REFRESH_MARGIN", 300))
+
+    # /process-text rate limit, shared by all workers through redis: cost units
+    # per user (or client address) over a sliding RATE_LIMIT_WINDOW seconds,
+    # one unit per RATE_LIMIT_UNIT_CHARS characters of text, 0 disables it
+    RATE_LIMIT_CAPACITY = int(os.getenv("RATE_LIMIT_CAPACITY", 1000))
+    RATE_LIMIT_WINDOW = float(os.getenv("RATE_LIMIT_WINDOW", 60))
+    RATE_LIMIT_UNIT_CHARS = int(os.getenv("RATE_LIMIT_UNIT_CHARS", 1000))
+    # counters kept per worker while redis is down, two per active identity
+    RATE_LIMIT_LOCAL_SIZE = int(os.getenv("RATE_LIMIT_LOCAL_SIZE", 10_000))
+    # reverse proxies in front of the app that append to X-Forwarded-For; the
+    # header is ignored when 0, as everything before their hops is client supplied
+    TRUSTED_PROXIES = int(os.getenv("TRUSTED_PROXIES", 0))
+
+    # documents per round trip to mongo while /user/get_documents streams
+    DOCUMENTS_PAGE_SIZE = int(os.getenv("DOCUMENTS_PAGE_SIZE", 50))
+
+    # default engine of /process-text/text: "embedding", "cascade" (embedding
+    # after a local prefilter), or the "tfidf" or "textrank" engines that need
+    # no network
+    RANKING_ENGINE = os.getenv("RANKING_ENGINE", "embedding")
+
+    # "cascade" engine: texts of at least CASCADE_MIN_SENTENCES sentences only
+    # embed the CASCADE_RATIO best of them by a local prefilter, the rest rank 0
+    CASCADE_RATIO = float(os.getenv("CASCADE_RATIO", 0.3))
+    CASCADE_MIN_SENTENCES = int(os.getenv("CASCADE_MIN_SENTENCES", 100))
+
+    # keyword extraction: spaCy model (a blank tokenizer is used if it is not
+    # installed), keywords returned, and characters of a text analyzed
+    KEYWORD_MODEL = os.getenv("KEYWORD_MODEL", "en_core_web_sm")
+    KEYWORD_COUNT = int(os.getenv("KEYWORD_COUNT", 10))
+    KEYWORD_MAX_CHARS = int(os.getenv("KEYWORD_MAX_CHARS", 100_000))
+    # part of every keywords cache key, bump when the extraction changes
+    KEYWORDS_VERSION = os.getenv("KEYWORDS_VERSION", "1")
+
+    # minimum rank of the sentences highlighted in saved documents
+    DEFAULT_RANKING = int(os.getenv("DEFAULT_RANKING", 3))
+
+    # sentences in the first batch of a streamed /process-text/text response
+    STREAM_FIRST_BATCH = int(os.getenv("STREAM_FIRST_BATCH", 25))
+
+    # max number of texts accepted by /process-text/batch
+    BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", 50))
+
+    # shared redis: one pooled client per worker, skipped for REDIS_RETRY_AFTER
+    # seconds after a connection failure
+    REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+    REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", 50))
+    REDIS_TIMEOUT = float(os.getenv("REDIS_TIMEOUT", 0.5))
+    REDIS_RETRY_AFTER = float(os.getenv("REDIS_RETRY_AFTER", 30))
+
+    # entries in the in-process tier in front of the redis result cache, and
+    # how long ranked texts are kept (seconds)
+    RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", 1024))
+    RESULT_CACHE_TTL = int(os.getenv("RESULT_CACHE_TTL", 60 * 60 * 24))
+
+    # part of every ranked-text cache key, bump when the ranking changes
+    RANKER_VERSION = os.getenv("RANKER_VERSION", "1")
+
+    # single-flight coalescing: how long a worker may hold the compute lock
+    # (seconds)
+    SINGLE_FLIGHT_LOCK_TTL = float(os.getenv("SINGLE_FLIGHT_LOCK_TTL", 60))
@@ -0,0 +1,17 @@
+# gunicorn.conf.py
+# gunicorn -c gunicorn.conf.py asgi:app
+
+import os
+import multiprocessing
+
+bind = f"0.0.0.0:{os.getenv('PORT', 3000)}"
+
+# every worker runs its own event loop, so a handful of processes can hold
+# hundreds of in-flight requests
+workers = int(os.getenv("WORKERS", multiprocessing.cpu_count()))
+worker_class = "uvicorn.workers.UvicornWorker"
+
+# streamed and book-length requests can take a while
+timeout = 120
+graceful_timeout = 30
+keepalive = 5
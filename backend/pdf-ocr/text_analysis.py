@@ -2,17 +2,24 @@
 
 import unittest
 import os
+import sys
 import ast
 
-from dotenv import load_dotenv
-import google.generativeai as genai
-
 from groq import Groq
 
 import asyncio
 import pprint
 import json
 
+# the LLM clients live in the backend services
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.text_analysis import (
+    get_llm_client,
+    parse_analysis,
+    generate_indexed_analysis,
+)
+
 # jwt imports
 
 
@@ -35,9 +42,7 @@ def example_groq(text):
 
 async def generate_analysis_groq(text):
 
-    client = Groq(
-        api_key=os.environ.get("GROQ_API_KEY"),
-    )
+    client = get_llm_client("groq")
 
     prompt = f"""
         Extract key information from the text below following these specific requirements:
@@ -86,21 +91,11 @@ async def generate_analysis_groq(text):
         Text to analyze: {text}
     """
 
-    chat_completion = client.chat.completions.create(
-        messages=[
-            {
-                "role": "user",
-                "content": prompt,
-            }
-        ],
-        model="llama-3.3-70b-versatile",
-        response_format={"type": "json_object"},
-        temperature=0.5,
+    raw_text = await client.generate(
+        prompt, response_format={"type": "json_object"}, temperature=0.5
     )
 
     try:
-        raw_text = chat_completion.choices[0].message.content
-
         pprint.pprint(text)
 
         pprint.pprint(json.loads(raw_text))
@@ -111,84 +106,29 @@ async def generate_analysis_groq(text):
         return {"keywords": [], "sentences": []}
 
 
-async def generate_analysis_sentence_rank(text):
-    # Configure the API with the key
-    load_dotenv()
-    genai.configure(api_key=os.getenv("API_KEY"))
-    model = genai.GenerativeModel("gemini-1.5-flash")
-
-    """Helper method to generate analysis using the Gemini model"""
-    prompt = f""" 
-        Analyze the text below and rank each sentence based on its relevance in conveying information. Follow these specific instructions:
-
-        1. **Keywords extraction rules**:
-        - Extract the most important keywords or phrases that capture the core ideas of the text.
-        - Each keyword should be 1-3 words maximum.
-        - Include only nouns, proper names, and technical terms.
-        - Exclude common words and generic verbs.
-        - Keywords should be lowercase unless they are proper nouns.
-        - Sort keywords alphabetically.
-        - Remove any punctuation from keywords.
-        - **Examples**:
-            - Valid: "machine learning," "Einstein," "global warming."
-            - Invalid: "is," "run," "quickly."
+# labels read-pdf.py highlights by, from the 0-5 ranks of the indexed protocol
+RANK_LABELS = {0: "low", 1: "low", 2: "low", 3: "average", 4: "high", 5: "high"}
 
-        2. **Relevance ranking for sentences**:
-        - Rank each sentence based on how much information it provides:
-            - **Low**: The sentence provides little to no new information or is overly generic.
-            - **Average**: The sentence provides some relevant information but lacks unique or critical insights.
-            - **High**: The sentence conveys key ideas, core arguments, or critical information central to understanding the main text.
-        - Consider sentences independently and in the context of the paragraph they belong to.
-        - Be consistent in applying the ranking criteria.
 
-        3. **Output format**:
-        - Return the results as a Python dictionary in this exact format:
-        {{
-            "keywords": [
-                "keyword1",
-                "keyword2",
-                "keyword3"
-            ],
-            "sentences": [
-                ["sentence 1", "low"],
-                ["sentence 2", "average"],
-                ["sentence 3", "high"]
-            ]
-        }}
-
-        4. **Examples**:
-        - **Low**: "The sky is blue." (Generic, not critical to the text's meaning.)
-        - **Average**: "The experiment produced unexpected results, but further analysis is needed." (Somewhat relevant but not highly informative.)
-        - **High**: "The discovery of DNA's double-helix structure revolutionized biology and genetics." (Highly informative and central to the topic.)
-
-        **Note**: The extracted sentences and keywords should work together to provide a clear understanding of the main idea of the passage. 
-
-        Text to analyze: {text}
-    """
-
-    response = model.generate_content(prompt)
-    raw_text = response.text.strip()
+async def generate_analysis_sentence_rank(text):
+    # numbered sentences in, [index, rank] pairs out: the model no longer
+    # repeats every sentence, which was most of the output tokens
+    client = get_llm_client("gemini", "gemini-1.5-flash")
 
-    # Remove code block markers if present
-    if raw_text.startswith("```") and raw_text.endswith("```"):
-        raw_text = raw_text.split("\n", 1)[1].rsplit("\n", 1)[0].strip()
-        if raw_text.startswith("python"):
-            raw_text = raw_text[6:].strip()
+    analysis = await generate_indexed_analysis(text, client)
 
-    try:
-        # Use ast.literal_eval instead of eval for safety
-        return ast.literal_eval(raw_text)
-    except (SyntaxError, ValueError):
-        # If parsing fails, return empty results
-        return {"keywords": [], "sentences": []}
+    return {
+        "keywords": analysis["keywords"],
+        "sentences": [
+            [sentence, RANK_LABELS[rank]]
+            for sentence, rank, _, _ in analysis["sentences"]
+        ],
+    }
 
 
 async def generate_analysis(text):
 
-    # Configure the API with the key
-    load_dotenv()
-    genai.configure(api_key=os.getenv("API_KEY"))
-    model = genai.GenerativeModel("gemini-1.5-flash")
+    client = get_llm_client("gemini", "gemini-1.5-flash")
 
     """Helper method to generate analysis using the Gemini model"""
     prompt = f""" 
@@ -232,21 +172,9 @@ async def generate_analysis(text):
 
         Text to analyze: {text}
         """
-    response = model.generate_content(prompt)
-    raw_text = response.text.strip()
-
-    # Remove code block markers if present
-    if raw_text.startswith("```") and raw_text.endswith("```"):
-        raw_text = raw_text.split("\n", 1)[1].rsplit("\n", 1)[0].strip()
-        if raw_text.startswith("python"):
-            raw_text = raw_text[6:].strip()
+    raw_text = await client.generate(prompt)
 
-    try:
-        # Use ast.literal_eval instead of eval for safety
-        return ast.literal_eval(raw_text)
-    except (SyntaxError, ValueError):
-        # If parsing fails, return empty results
-        return {"keywords": [], "sentences": []}
+    return parse_analysis(raw_text)
 
 
 async def main():
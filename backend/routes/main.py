@@ -1,4 +1,4 @@
-from flask import Blueprint, request, jsonify
+from quart import Blueprint, request, jsonify
 
 
 main_bp = Blueprint("main", __name__)
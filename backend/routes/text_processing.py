@@ -1,32 +1,81 @@
 # text_processing.py
-from flask import Blueprint, request, jsonify
-
-from services.text_analysis import generate_analysis
-
-from utils.decorators import authorization_required, async_authorization_required
-from services.caching import cache_url, retrieve_cache_url
+from quart import Blueprint, request, jsonify
+
+from services.text_analysis import generate_indexed_analysis, stream_analysis
+
+from utils.decorators import (
+    authorization_required,
+    async_authorization_required,
+    auth_stats,
+    rate_limited,
+)
+from utils.streaming import ndjson_response
+from services.caching import (
+    cache_url,
+    retrieve_cache_url,
+    cache_result,
+    retrieve_result,
+    content_hash,
+)
+from services.single_flight import single_flight
+from services.rate_limiting import character_cost
+from services.embeddings import get_embedding_provider
+from services.embedding_cache import embedding_cache, embed_with_cache
+from services.ranking import rank_sentences
+from services.local_ranking import (
+    LOCAL_ENGINES,
+    prefilter_sentences,
+    rank_sentences_locally,
+)
+from services.keywords import get_keywords
+from services.sentencizer import get_all_sentences, split_sentences
 
 import json
+import asyncio
+import unicodedata
+
+from config import Config
 
 # imports for embeddings
-from sklearn.ensemble import RandomForestClassifier
-from sklearn.metrics import roc_auc_score
-import google.generativeai as genai
 import os
-from spacy.lang.en import English
 import numpy as np
-from sentence_transformers import util
 import pickle
 import time
 
 
 text_processing_bp = Blueprint("process-text", __name__)
 
+# "embedding" ranks with the configured embedding provider, "cascade" only
+# embeds the sentences a local prefilter keeps, the local engines need no network
+RANKING_ENGINES = ("embedding", "cascade") + LOCAL_ENGINES
+
+
+def text_cost(data):
+    return character_cost(str(data.get("text", "")))
+
 
-# @text_processing_bp.route("/text", methods=["POST"])
-# @async_authorization_required()
+def batch_cost(data):
+    items = data.get("items")
+    if not isinstance(items, list):
+        return 1
+
+    return character_cost(
+        *[str(item.get("text", "")) for item in items if isinstance(item, dict)]
+    )
+
+
+# keywords and sentence ranks from the LLM, for signed-in users
+@text_processing_bp.route("/analysis", methods=["POST"])
+@async_authorization_required()
+@rate_limited(text_cost)
 async def process_text():
-    data = request.get_json()
+    """
+    Takes {text, url, ranking, engine, stream, keywords} and returns
+    {keywords, sentences}, where each sentence is {sentence, start, end, rank}
+    and text[start:end] is the sentence, so the client can highlight it in
+    place. The local engines only extract keywords when "keywords" is true.
+    """
+    data = await request.get_json()
     text = data["text"]
     ranking = data.get("ranking", False)
 
@@ -34,181 +83,427 @@ async def process_text():
     url = data.get("url", False)
     # url = None
 
-    if ranking:
-        ranking = int(ranking)
+    ranking = int(ranking) if ranking else 0
 
     result = None
 
     if url:
         # Check if the URL is already cached
-        cached_data = retrieve_cache_url(repr(url))
-
-        if cached_data:
-            result = json.loads(cached_data)
+        result = await retrieve_cache_url(url)
 
     if not text:
         return jsonify({"error": "No text provided"}), 400
 
+    # local engines rank without calling a model
+    engine = data.get("engine")
+    if result is None and engine in LOCAL_ENGINES:
+        sentences, keywords = await asyncio.gather(
+            rank_spans_locally(text, engine), requested_keywords(data, text)
+        )
+        result = {"keywords": keywords, "sentences": sentences}
+
+    # opt-in streaming: each keyword and ranked sentence is forwarded as soon
+    # as the model has finished writing it
+    if result is None and data.get("stream", False):
+        return ndjson_response(stream_analysis_messages(text, ranking))
+
     # Use the service to extract keywords only if the result is not already cached
     if result is None:
-        result = await generate_analysis(text)
+        # sentences go out numbered and come back as [index, rank] pairs,
+        # analyzed in concurrent groups on long pages
+        result = await generate_indexed_analysis(text)
 
         if url:
-            cache_url(repr(url), result)
+            await cache_url(url, result)
+
+    # a new response, the analysis (possibly the cached one) is left intact
+    response = {
+        **result,
+        "sentences": [
+            sentence_item(*sentence)
+            for sentence in result["sentences"]
+            if sentence[1] >= ranking
+        ],
+    }
 
-    only_rank_sentences = []
+    # TODO : handle the case when the result is None (no keywords or sentences extracted)
 
-    for sentence in result["sentences"]:
-        sentence_rank = sentence[1]
-        sentence_text = sentence[0]
-        if sentence[1] >= ranking:
-            only_rank_sentences.append(sentence_text)
+    return jsonify(response)
 
-    result["sentences"] = only_rank_sentences
 
-    # TODO : handle the case when the result is None (no keywords or sentences extracted)
+def sentence_item(sentence, rank, start, end):
+    return {"sentence": sentence, "start": start, "end": end, "rank": rank}
 
-    return jsonify(result)
 
+async def rank_spans_locally(text, engine):
+    # [sentence, rank, start, end] in document order, like the LLM analysis
+    spans = await asyncio.to_thread(split_sentences, text)
+    indices, scores, ranks = await asyncio.to_thread(
+        rank_sentences_locally, [sentence for sentence, _, _ in spans], engine
+    )
 
-def generate_embeddings(text, my_key):
-    genai.configure(api_key=os.getenv("IAN_API_KEY"))
+    sentences = [None] * len(spans)
+    for i, rank in zip(indices, ranks):
+        sentence, start, end = spans[i]
+        sentences[i] = [sentence, int(rank), start, end]
 
-    response = genai.embed_content(model="models/text-embedding-004", content=text)
+    return sentences
 
-    return response
 
+async def stream_analysis_messages(text, ranking):
+    async for key, value in stream_analysis(text):
+        if key == "keywords":
+            yield {"type": "keyword", "keyword": value}
+        elif key == "sentences" and value[1] >= ranking:
+            yield {"type": "sentence", **sentence_item(*value)}
 
-def generate_batch_embeddings(sentences, key):
-    genai.configure(api_key=os.getenv("IAN_API_KEY"))
 
-    response = genai.embed_content(model="models/text-embedding-004", content=sentences)
+async def get_embeddings(sentences, key):
+    # cached, concurrently batched embeddings from the configured provider
+    return await embed_with_cache(sentences)
 
-    return response["embedding"]
 
+def generate_full_text_embeddings(sentence_embeddings):
 
-def get_embeddings(sentences, key):
-    embeddings = []
+    # using the mean of the embeddings
+    full_text_embedding = np.mean(sentence_embeddings, axis=0)
+
+    return full_text_embedding
 
-    batch_size = 250
 
-    for i in range(0, len(sentences), batch_size):
-        batch = sentences[i : i + batch_size]
-        embeddings += generate_batch_embeddings(batch, key)
+def filter_ranked_sentences(sentences, indices, ranks, ranking):
+    # sentences at or above the requested rank, ordered by decreasing score
+    if not ranking:
+        return []
+
+    return [sentences[i] for i in indices[ranks >= int(ranking)]]
+
+
+async def stream_ranked_sentences(all_sentences, ranking):
+    """
+    Embeds and ranks the text batch by batch, in document order. Each batch is
+    ranked against the running centroid of everything embedded so far and
+    emitted as a "partial" message, so the top of the page can be highlighted
+    right away. A "final" message then carries the exact global ranking.
+    """
+    provider = get_embedding_provider()
+    key = os.getenv("IAN_API_KEY")
+
+    # a small first batch keeps time-to-first-highlight low
+    first = min(Config.STREAM_FIRST_BATCH, len(all_sentences))
+    bounds = [(0, first)] if first else []
+    for start in range(first, len(all_sentences), provider.batch_size):
+        bounds.append((start, min(start + provider.batch_size, len(all_sentences))))
+
+    semaphore = asyncio.Semaphore(Config.EMBEDDING_CONCURRENCY)
+
+    async def embed_batch(start, end):
+        async with semaphore:
+            return await get_embeddings(all_sentences[start:end], key)
+
+    # every batch is requested up front, results are consumed in order
+    tasks = [asyncio.ensure_future(embed_batch(start, end)) for start, end in bounds]
+
+    parts = []
+    running_sum = None
+
+    try:
+        for (start, end), task in zip(bounds, tasks):
+            embeddings = await task
+            parts.append(embeddings)
+
+            batch_sum = embeddings.sum(axis=0)
+            running_sum = batch_sum if running_sum is None else running_sum + batch_sum
+
+            indices, scores, ranks = rank_sentences(
+                embeddings, provider.buckets, centroid=running_sum / end
+            )
+
+            yield {
+                "type": "partial",
+                "start": start,
+                "end": end,
+                "sentences": filter_ranked_sentences(
+                    all_sentences[start:end], indices, ranks, ranking
+                ),
+            }
+    finally:
+        for task in tasks:
+            task.cancel()
+
+    sentences = []
+    if parts:
+        embeddings = np.vstack(parts)
+        indices, scores, ranks = rank_sentences(
+            embeddings, provider.buckets, centroid=running_sum / len(embeddings)
+        )
+        sentences = filter_ranked_sentences(all_sentences, indices, ranks, ranking)
+
+    yield {"type": "final", "sentences": sentences, "keywords": []}
+
+
+async def cascade_candidates(all_sentences):
+    """
+    Indices of the sentences worth embedding in document order, or None when
+    the text is too short for the prefilter to pay off.
+    """
+    if len(all_sentences) < Config.CASCADE_MIN_SENTENCES:
+        return None
+
+    kept = await asyncio.to_thread(
+        prefilter_sentences, all_sentences, Config.CASCADE_RATIO
+    )
+    print(f"Cascade kept {len(kept)} of {len(all_sentences)} sentences")
+
+    return kept
+
+
+async def rank_text(text, engine="embedding"):
+    """
+    Splits, embeds and ranks text. Returns [sentence, rank, score] for every
+    sentence, ordered by decreasing score.
+    """
+    # sentence splitting is CPU bound, keep it off the event loop
+    all_sentences = await asyncio.to_thread(get_all_sentences, text)
+
+    if engine in LOCAL_ENGINES:
+        indices, scores, ranks = await asyncio.to_thread(
+            rank_sentences_locally, all_sentences, engine
+        )
+
+        return [
+            [all_sentences[i], int(rank), float(score)]
+            for i, rank, score in zip(indices, ranks, scores)
+        ]
+
+    kept = await cascade_candidates(all_sentences) if engine == "cascade" else None
+    candidates = all_sentences if kept is None else [all_sentences[i] for i in kept]
 
-    return embeddings
+    # get the embeddings
 
+    # uncomment this like when testing
+    # if os.path.exists("embeddings.pkl"):
+    #     with open("embeddings.pkl", "rb") as f:
+    #         embeddings = pickle.load(f)
+    # else:
+    initial_time = time.time()
+    print("Generating embeddings")
+    embeddings = await get_embeddings(candidates, os.getenv("IAN_API_KEY"))
+    print("Time taken to generate embeddings: ", time.time() - initial_time)
+    print("Embedding cache: ", embedding_cache.stats())
 
-def generate_full_text_embeddings(sentence_embeddings):
+    # save the embeddings
+    # with open("embeddings.pkl", "wb") as f:
+    #     pickle.dump(embeddings, f)
 
-    # using the mean of the embeddings
-    full_text_embedding = np.mean(sentence_embeddings, axis=0)
+    initial_time = time.time()
+    print("Generating full text embeddings")
+    full_text_embedding = generate_full_text_embeddings(embeddings)
+    print("Time taken to generate full text embeddings: ", time.time() - initial_time)
 
-    return full_text_embedding
+    initial_time = time.time()
+    print("Getting key sentences")
+    indices, scores, ranks = rank_sentences(
+        embeddings,
+        get_embedding_provider().buckets,
+        centroid=full_text_embedding,
+    )
+    print("Time taken to get key sentences: ", time.time() - initial_time)
+
+    ranked = [
+        [candidates[i], int(rank), float(score)]
+        for i, rank, score in zip(indices, ranks, scores)
+    ]
+
+    if kept is not None:
+        # sentences dropped by the prefilter rank 0, below every cosine score
+        dropped = np.setdiff1d(np.arange(len(all_sentences)), kept)
+        ranked += [[all_sentences[i], 0, -1.0] for i in dropped]
 
+    return ranked
 
-# TODO: Ensure that we eliminate atleast half
-def cosine_to_rank(cosine_score):
-    # convert cosine score to a rank
-    buckets = [0.65, 0.7, 0.75, 0.8, 0.9]
-    buckets = sorted(buckets, reverse=True)
 
-    for i, bucket in enumerate(buckets):
-        if cosine_score >= bucket:
-            return 5 - i + 1
+def ranked_text_key(text, engine="embedding"):
+    # bumping RANKER_VERSION or switching models starts a fresh set of entries
+    text = unicodedata.normalize("NFC", text.replace("\r\n", "\n")).strip()
+    model = engine if engine in LOCAL_ENGINES else get_embedding_provider().name
 
-    return 0
+    if engine == "cascade":
+        model += f":cascade:{Config.CASCADE_RATIO}:{Config.CASCADE_MIN_SENTENCES}"
 
+    return f"ranked:{Config.RANKER_VERSION}:{content_hash(model, text)}"
 
-def get_key_sentences(all_sentences, embeddings, full_text_embedding, n=5):
 
-    embeddings = np.array(embeddings)
+async def rank_and_cache_text(text, key, engine="embedding"):
+    ranked = await rank_text(text, engine)
+    await cache_result(key, ranked)
 
-    # Compute cosine-similarities
-    cosine_scores = util.pytorch_cos_sim(full_text_embedding, embeddings)
+    return ranked
 
-    # Find the pairs with the highest cosine similarity scores
-    pairs = []
-    for i in range(len(cosine_scores[0])):
-        pairs.append({"index": i, "score": cosine_scores[0][i]})
 
-    # Sort scores in decreasing order
-    pairs = sorted(pairs, key=lambda x: x["score"], reverse=True)
+async def get_ranked_text(text, engine="embedding"):
+    # the full ranking is cached by content, so any threshold and any URL
+    # showing the same text reuse it
+    key = ranked_text_key(text, engine)
+    ranked = await retrieve_result(key)
 
-    top_sentences = []
+    if ranked is None:
+        # identical texts arriving together share one embedding and ranking run
+        ranked = await single_flight(
+            key, lambda: rank_and_cache_text(text, key, engine)
+        )
 
-    for pair in pairs:
-        sentence_score = float(pair["score"])
-        sentence_rank = cosine_to_rank(sentence_score)
+    return ranked
 
-        top_sentences.append((all_sentences[pair["index"]], sentence_rank))
 
-    return top_sentences
+async def requested_keywords(data, text):
+    # keywords are opt-in, spaCy takes longer than the local engines rank
+    if not data.get("keywords", False):
+        return []
 
+    return await get_keywords(text)
 
-def get_all_sentences(text):
-    nlp = English()
-    nlp.add_pipe("sentencizer", first=True)
 
-    def split_sentences(text):
-        doc = nlp(text)
-        return [sent.text for sent in doc.sents]
+async def with_keywords(messages, keywords):
+    # fills the final message with keywords extracted while ranking ran
+    try:
+        async for message in messages:
+            if message["type"] == "final":
+                message["keywords"] = await keywords
+            yield message
+    finally:
+        keywords.cancel()
 
-    all_sentences = split_sentences(text)
 
-    return all_sentences
+async def stream_local_ranking(text, engine, ranking):
+    ranked = await rank_text(text, engine)
+
+    sentences = []
+    if ranking:
+        sentences = [sentence for sentence, rank, _ in ranked if rank >= int(ranking)]
+
+    yield {"type": "final", "sentences": sentences, "keywords": []}
 
 
 @text_processing_bp.route("/text", methods=["POST"])
+@rate_limited(text_cost)
 async def process_text_transformer():
     print("Processing text")
-    data = request.get_json()
+    data = await request.get_json()
+    if not isinstance(data, dict) or "text" not in data:
+        return jsonify({"error": "No text provided"}), 400
+
     text = str(data["text"])
     ranking = data.get("ranking", False)
+    engine = data.get("engine") or Config.RANKING_ENGINE
     result = {
         "sentences": [],
         "keywords": [],
     }
 
-    all_sentences = get_all_sentences(text)
+    if engine not in RANKING_ENGINES:
+        return jsonify({"error": f"Unknown ranking engine: {engine}"}), 400
 
-    # get the embeddings
+    # opt-in streaming: newline-delimited JSON, one message per batch
+    if data.get("stream", False):
+        keywords = asyncio.ensure_future(requested_keywords(data, text))
 
-    # uncomment this like when testing
-    # if os.path.exists("embeddings.pkl"):
-    #     with open("embeddings.pkl", "rb") as f:
-    #         embeddings = pickle.load(f)
-    # else:
-    initial_time = time.time()
-    print("Generating embeddings")
-    embeddings = get_embeddings(all_sentences, os.getenv("IAN_API_KEY"))
-    print("Time taken to generate embeddings: ", time.time() - initial_time)
+        if engine in LOCAL_ENGINES:
+            # local ranking is fast enough to send in one final message
+            messages = stream_local_ranking(text, engine, ranking)
+        else:
+            all_sentences = await asyncio.to_thread(get_all_sentences, text)
 
-    # save the embeddings
-    # with open("embeddings.pkl", "wb") as f:
-    #     pickle.dump(embeddings, f)
+            if engine == "cascade":
+                # only the kept sentences are streamed: the dropped ones rank 0
+                # and are never highlighted
+                kept = await cascade_candidates(all_sentences)
+                if kept is not None:
+                    all_sentences = [all_sentences[i] for i in kept]
 
-    initial_time = time.time()
-    print("Generating full text embeddings")
-    full_text_embedding = generate_full_text_embeddings(embeddings)
-    print("Time taken to generate full text embeddings: ", time.time() - initial_time)
+            messages = stream_ranked_sentences(all_sentences, ranking)
 
-    initial_time = time.time()
-    print("Getting key sentences")
-    top_sentences = get_key_sentences(all_sentences, embeddings, full_text_embedding)
-    print("Time taken to get key sentences: ", time.time() - initial_time)
+        return ndjson_response(with_keywords(messages, keywords))
+
+    # keywords, when asked for, are extracted alongside the sentence ranking
+    ranked, result["keywords"] = await asyncio.gather(
+        get_ranked_text(text, engine), requested_keywords(data, text)
+    )
 
     if ranking:
-        ranking = int(ranking)
+        result["sentences"] = [
+            sentence for sentence, rank, _ in ranked if rank >= int(ranking)
+        ]
 
-        only_rank_sentences = []
+    return jsonify(result)
 
-        for sentence in top_sentences:
-            sentence_rank = sentence[1]
-            sentence_text = sentence[0]
-            if sentence_rank >= ranking:
-                only_rank_sentences.append(sentence_text)
 
-        result["sentences"] = only_rank_sentences
+@text_processing_bp.route("/batch", methods=["POST"])
+@rate_limited(batch_cost)
+async def process_text_batch():
+    """
+    Ranks many texts in one request. Takes {"items": [{id, text, url, ranking}],
+    "keywords"} and returns {"results": [{id, sentences, keywords}]} in the same
+    order, with keywords only when "keywords" is true.
+    """
+    data = await request.get_json()
+    items = data.get("items") if isinstance(data, dict) else None
 
-    return jsonify(result)
+    if not isinstance(items, list) or not items:
+        return jsonify({"error": "No items provided"}), 400
+
+    if len(items) > Config.BATCH_MAX_ITEMS:
+        return jsonify({"error": f"At most {Config.BATCH_MAX_ITEMS} items"}), 413
+
+    if not all(isinstance(item, dict) for item in items):
+        return jsonify({"error": "Every item must be an object"}), 400
+
+    print(f"Processing batch of {len(items)} texts")
+
+    # split every text concurrently, off the event loop
+    texts = [str(item.get("text", "")) for item in items]
+    item_keywords = asyncio.ensure_future(
+        asyncio.gather(*[requested_keywords(data, text) for text in texts])
+    )
+    item_sentences = await asyncio.gather(
+        *[asyncio.to_thread(get_all_sentences, text) for text in texts]
+    )
+
+    # embed each distinct sentence once, sharing provider batches across items
+    unique_sentences = list(
+        dict.fromkeys(sentence for sentences in item_sentences for sentence in sentences)
+    )
+    position = {sentence: i for i, sentence in enumerate(unique_sentences)}
+
+    initial_time = time.time()
+    embeddings = await get_embeddings(unique_sentences, os.getenv("IAN_API_KEY"))
+    print("Time taken to generate batch embeddings: ", time.time() - initial_time)
+
+    buckets = get_embedding_provider().buckets
+    results = []
+
+    for item, sentences, keywords in zip(items, item_sentences, await item_keywords):
+        result = {"id": item.get("id"), "sentences": [], "keywords": keywords}
+
+        if sentences:
+            # each text is ranked against its own centroid
+            item_embeddings = embeddings[[position[sentence] for sentence in sentences]]
+            indices, scores, ranks = rank_sentences(
+                item_embeddings,
+                buckets,
+                centroid=generate_full_text_embeddings(item_embeddings),
+            )
+            result["sentences"] = filter_ranked_sentences(
+                sentences, indices, ranks, item.get("ranking", False)
+            )
+
+        results.append(result)
+
+    return jsonify({"results": results})
+
+
+@text_processing_bp.route("/stats", methods=["GET"])
+def processing_stats():
+    return jsonify(
+        {"embedding_cache": embedding_cache.stats(), "auth": auth_stats()}
+    )
@@ -1,36 +1,40 @@
 # text_processing.py
-from flask import Blueprint, request, jsonify
+from quart import Blueprint, request, jsonify
 
-from utils.decorators import authorization_required, async_authorization_required
+from utils.decorators import async_authorization_required
+from services.document_ranking import update_document_ranking, get_ranked_sentences
+from services.sentencizer import split_sentences
+from services.database import get_mongo_client
+from utils.streaming import json_array_response
+from config import Config
 
 import asyncio
-from motor.motor_asyncio import AsyncIOMotorClient
 
-import os
-
-import json
+from datetime import datetime, timezone
+from bson.errors import InvalidId
 from bson.objectid import ObjectId
+from pymongo import ReplaceOne, UpdateOne
 
 
 user_bp = Blueprint("user", __name__)
 
+# fields a client may ask for when listing documents
+DOCUMENT_FIELDS = {"_id", "title", "text", "keywords", "sentences", "updated_at"}
+DEFAULT_LIST_FIELDS = ["_id", "title", "updated_at"]
+MAX_PAGE_SIZE = 200
 
-def get_mongo_client():
-    if os.getenv("ENV") == "production":
-        return AsyncIOMotorClient(
-            os.getenv("MONGO_URI"), tlsAllowInvalidCertificates=True
-        )
-    else:
-        return AsyncIOMotorClient(
-            os.getenv("MONGO_URI"), tlsAllowInvalidCertificates=True
-        )
+# fields a client may set directly, "text" also re-ranks the document
+UPDATABLE_FIELDS = {"title", "text", "keywords", "sentences"}
+
+# background re-rankings of stale documents in this worker, by document id
+_reranking = {}
 
 
 @user_bp.route("/add_document", methods=["POST"])
 @async_authorization_required()
 async def add_document():
     try:
-        data = request.get_json()
+        data = await request.get_json()
         user_id = data["uid"]
 
         mong_client = get_mongo_client()
@@ -44,6 +48,7 @@ async def add_document():
             "user_id": user_id,
             "keywords": [],
             "sentences": [],
+            "updated_at": datetime.now(timezone.utc),
         }
 
         result = await collection.insert_one(document)
@@ -61,7 +66,7 @@ async def add_document():
 @async_authorization_required()
 async def get_document_by_id():
     try:
-        data = request.get_json()
+        data = await request.get_json()
         user_id = data["uid"]
         document_id = data["document_id"]
 
@@ -70,14 +75,30 @@ async def get_document_by_id():
         db = mong_client.get_database("readEase")
         collection = db.get_collection("documents")
 
-        document = await collection.find_one(
-            {"user_id": user_id, "_id": ObjectId(document_id)}
-        )
+        query = {"user_id": user_id, "_id": ObjectId(document_id)}
+
+        # the ranking state is internal, only the stored ranks are read back
+        document = await collection.find_one(query)
 
         if document is None:
             return jsonify({"error": "Document not found"}), 404
 
         document["_id"] = str(document["_id"])
+        ranking_state = document.pop("ranking_state", None)
+
+        if ranking_state and ranking_state.get("stale"):
+            # the last edit was saved without ranking: the stored sentences
+            # are served and the ranking is retried without holding the read
+            _schedule_rerank(db, query, document["text"])
+            ranking_state = None
+
+        # highlights for any threshold come from the precomputed ranks,
+        # without touching the embedding provider
+        ranking = data.get("ranking")
+        if ranking is not None and ranking_state:
+            document["sentences"] = get_ranked_sentences(
+                ranking_state, document["text"], ranking
+            )
 
         return jsonify(document), 200
     except Exception as e:
@@ -88,19 +109,44 @@ async def get_document_by_id():
 @user_bp.route("/get_documents", methods=["POST"])
 @async_authorization_required()
 async def get_documents():
-
+    """
+    Lists a user's documents, one page at a time, as a streamed JSON array.
+
+    Optional body fields: "limit" (page size, every document when absent),
+    "after" (the _id of the last document of the previous page) and "fields"
+    (projection, defaults to title and updated_at; _id is always included).
+    A page shorter than "limit" is the last one.
+    """
     try:
-        data = request.get_json()
+        data = await request.get_json()
         user_id = data["uid"]
 
+        limit = data.get("limit")
+        if limit is not None:
+            limit = min(int(limit), MAX_PAGE_SIZE)
+        fields = data.get("fields") or DEFAULT_LIST_FIELDS
+
         mong_client = get_mongo_client()
 
         db = mong_client.get_database("readEase")
         collection = db.get_collection("documents")
 
-        documents = await collection.find({"user_id": user_id}).to_list(length=None)
+        # keyset pagination on the {user_id, _id} index
+        query = {"user_id": user_id}
+        if data.get("after"):
+            query["_id"] = {"$gt": ObjectId(data["after"])}
 
-        return json.loads(json.dumps(documents, default=str))
+        projection = {field: 1 for field in fields if field in DOCUMENT_FIELDS}
+
+        cursor = (
+            collection.find(query, projection or {"_id": 1})
+            .sort("_id", 1)
+            .batch_size(limit or Config.DOCUMENTS_PAGE_SIZE)
+        )
+        if limit:
+            cursor = cursor.limit(limit)
+
+        return json_array_response(cursor)
     except Exception as e:
         print(e)
         return jsonify({"error": "An error occurred"}), 404
@@ -109,7 +155,7 @@ async def get_documents():
 @user_bp.route("/delete_document", methods=["POST"])
 @async_authorization_required()
 async def delete_document():
-    data = request.get_json()
+    data = await request.get_json()
     user_id = data["uid"]
     document_id = data["document_id"]
 
@@ -118,86 +164,325 @@ async def delete_document():
     db = mong_client.get_database("readEase")
     collection = db.get_collection("documents")
 
-    result = await collection.delete_one({"user_id": user_id, "_id": document_id})
+    query = {"user_id": user_id, "_id": ObjectId(document_id)}
 
-    return jsonify(result)
+    result, _ = await asyncio.gather(
+        collection.delete_one(query),
+        db.get_collection("document_embeddings").delete_one(query),
+    )
 
+    return jsonify({"deleted_count": result.deleted_count})
 
-@user_bp.route("/change_document_title", methods=["POST"])
-@async_authorization_required()
-async def change_document_title():
-    data = request.get_json()
-    user_id = data["uid"]
-    document_id = data["document_id"]
-    title = data["title"]
-
-    mong_client = get_mongo_client()
 
-    db = mong_client.get_database("readEase")
+async def _rank_document_text(db, query, text, ranking):
+    """
+    Re-ranks a document for its new text. Returns the fields to $set on the
+    document and the replacement for its stored embeddings (None if ranking
+    failed and only the text is saved), or None if the document does not
+    exist.
+    """
     collection = db.get_collection("documents")
+    embeddings_collection = db.get_collection("document_embeddings")
 
-    result = await collection.update_one(
-        {"user_id": user_id, "_id": document_id}, {"$set": {"title": title}}
+    document, stored = await asyncio.gather(
+        collection.find_one(query, {"text": 1, "ranking_state": 1}),
+        embeddings_collection.find_one(query),
     )
 
-    return jsonify(result)
+    if document is None:
+        return None
 
+    # only sentences added by the edit are embedded, the rest reuse their
+    # stored embeddings and are re-ranked against the updated centroid
+    spans = await asyncio.to_thread(split_sentences, text)
 
-@user_bp.route("/change_document_text", methods=["POST"])
+    try:
+        ranking_state, ranks, embeddings = await update_document_ranking(
+            document.get("ranking_state"),
+            document.get("text", ""),
+            spans,
+            stored["embeddings"] if stored else None,
+        )
+    except Exception as e:
+        # the edit is saved even when the embedding provider fails, and the
+        # document is re-ranked on its next edit or read
+        print(e)
+        return {"text": text, "sentences": [], "ranking_state": {"stale": True}}, None
+
+    sentences = [
+        sentence for (sentence, _, _), rank in zip(spans, ranks) if rank >= ranking
+    ]
+
+    # embeddings live in a sibling collection so reading a document stays small
+    embeddings_write = ReplaceOne(
+        query,
+        {
+            "user_id": query["user_id"],
+            "model": ranking_state["model"],
+            "embeddings": embeddings,
+        },
+        upsert=True,
+    )
+
+    fields = {"text": text, "sentences": sentences, "ranking_state": ranking_state}
+
+    return fields, embeddings_write
+
+
+async def _rerank_document(db, query, text):
+    """
+    Ranks a document whose last ranking failed and saves the result. Returns
+    the new ranking state, or None if ranking failed again.
+    """
+    ranked = await _rank_document_text(db, query, text, Config.DEFAULT_RANKING)
+
+    if ranked is None or ranked[1] is None:
+        return None
+
+    fields, embeddings_write = ranked
+
+    # an edit saved in the meantime wins over the ranking of the older text
+    result = await db.get_collection("documents").update_one(
+        {**query, "text": text}, {"$set": fields}
+    )
+    if result.matched_count == 0:
+        return None
+
+    await db.get_collection("document_embeddings").bulk_write([embeddings_write])
+
+    return fields["ranking_state"]
+
+
+def _reranked(document_id, task):
+    _reranking.pop(document_id, None)
+
+    # failures were logged while ranking, the next read or edit retries
+    if not task.cancelled():
+        task.exception()
+
+
+def _schedule_rerank(db, query, text):
+    # a document read many times while stale is re-ranked once
+    document_id = str(query["_id"])
+    if document_id in _reranking:
+        return
+
+    task = asyncio.ensure_future(_rerank_document(db, query, text))
+    _reranking[document_id] = task
+    task.add_done_callback(lambda done: _reranked(document_id, done))
+
+
+async def _prepare_update(db, user_id, document_id, fields, ranking):
+    """
+    Builds the writes for one document: the query, the fields to $set at once
+    and, if the text changed, the ReplaceOne of its embeddings. Raises
+    ValueError for fields that cannot be updated, InvalidId for a malformed
+    document_id and LookupError if the text changed on a missing document.
+    """
+    unknown = set(fields) - UPDATABLE_FIELDS
+    if not fields or unknown:
+        raise ValueError(f"Cannot update fields: {sorted(unknown)}")
+
+    query = {"user_id": user_id, "_id": ObjectId(document_id)}
+
+    update, embeddings_write = {}, None
+
+    if "text" in fields:
+        ranked = await _rank_document_text(db, query, fields["text"], ranking)
+        if ranked is None:
+            raise LookupError(document_id)
+
+        update, embeddings_write = ranked
+
+    # sentences sent by the client win over the ranked ones
+    update.update(fields)
+    update["updated_at"] = datetime.now(timezone.utc)
+
+    return query, update, embeddings_write
+
+
+async def _apply_updates(db, writes):
+    # one bulk_write per collection instead of one round trip per document
+    document_writes = [
+        UpdateOne(query, {"$set": update}) for query, update, _ in writes
+    ]
+    embeddings_writes = [
+        embeddings_write for _, _, embeddings_write in writes if embeddings_write
+    ]
+
+    result, _ = await asyncio.gather(
+        db.get_collection("documents").bulk_write(document_writes, ordered=False),
+        db.get_collection("document_embeddings").bulk_write(
+            embeddings_writes, ordered=False
+        )
+        if embeddings_writes
+        else asyncio.sleep(0),
+    )
+
+    return {
+        "matched_count": result.matched_count,
+        "modified_count": result.modified_count,
+    }
+
+
+async def update_document_fields(
+    user_id, document_id, fields, ranking=Config.DEFAULT_RANKING
+):
+    db = get_mongo_client().get_database("readEase")
+
+    writes = [await _prepare_update(db, user_id, document_id, fields, ranking)]
+
+    return await _apply_updates(db, writes)
+
+
+@user_bp.route("/document", methods=["PATCH"])
 @async_authorization_required()
-async def change_document_text():
-    data = request.get_json()
+async def patch_document():
+    """
+    Updates any of title, text, keywords and sentences of one document in a
+    single write. Body: {"uid", "document_id", "fields": {...}}. A new text
+    is re-ranked and its highlighted sentences are returned.
+    """
+    data = await request.get_json()
     user_id = data["uid"]
     document_id = data["document_id"]
-    text = data["text"]
+    fields = data.get("fields") or {}
+    ranking = int(data.get("ranking", Config.DEFAULT_RANKING))
 
-    mong_client = get_mongo_client()
+    db = get_mongo_client().get_database("readEase")
 
-    db = mong_client.get_database("readEase")
-    collection = db.get_collection("documents")
+    try:
+        writes = [await _prepare_update(db, user_id, document_id, fields, ranking)]
+    except LookupError:
+        return jsonify({"error": "Document not found"}), 404
+    except (ValueError, InvalidId) as e:
+        return jsonify({"error": str(e)}), 400
 
-    result = await collection.update_one(
-        {"user_id": user_id, "_id": document_id}, {"$set": {"text": text}}
-    )
+    result = await _apply_updates(db, writes)
 
-    return jsonify(result)
+    if result["matched_count"] == 0:
+        return jsonify({"error": "Document not found"}), 404
 
+    response = {"document_id": document_id, **result}
+    if "text" in fields:
+        # no highlights until a failed ranking is redone
+        response["sentences"] = writes[0][1].get("sentences", [])
 
-@user_bp.route("/change_document_keywords", methods=["POST"])
+    return jsonify(response), 200
+
+
+@user_bp.route("/documents", methods=["PATCH"])
 @async_authorization_required()
-async def change_document_keywords():
-    data = request.get_json()
+async def patch_documents():
+    """
+    Bulk form of PATCH /document. Body: {"uid", "items": [{"document_id",
+    "fields"}, ...]}. Every item is applied in one bulk_write.
+    """
+    data = await request.get_json()
     user_id = data["uid"]
-    document_id = data["document_id"]
-    keywords = data["keywords"]
+    items = data.get("items") or []
+    ranking = int(data.get("ranking", Config.DEFAULT_RANKING))
 
-    mong_client = get_mongo_client()
+    if not isinstance(items, list) or not items:
+        return jsonify({"error": "No items to update"}), 400
 
-    db = mong_client.get_database("readEase")
-    collection = db.get_collection("documents")
+    if len(items) > Config.BATCH_MAX_ITEMS:
+        return jsonify({"error": f"At most {Config.BATCH_MAX_ITEMS} items"}), 413
+
+    if not all(_is_update_item(item) for item in items):
+        return (
+            jsonify({"error": "Every item must be an object with a document_id"}),
+            400,
+        )
+
+    db = get_mongo_client().get_database("readEase")
 
-    result = await collection.update_one(
-        {"user_id": user_id, "_id": document_id}, {"$set": {"keywords": keywords}}
+    try:
+        writes = await asyncio.gather(
+            *[
+                _prepare_update(
+                    db, user_id, item["document_id"], item.get("fields") or {}, ranking
+                )
+                for item in items
+            ]
+        )
+    except LookupError as e:
+        return jsonify({"error": f"Document not found: {e}"}), 404
+    except (ValueError, InvalidId) as e:
+        return jsonify({"error": str(e)}), 400
+
+    return jsonify(await _apply_updates(db, writes)), 200
+
+
+def _is_update_item(item):
+    return (
+        isinstance(item, dict)
+        and isinstance(item.get("document_id"), str)
+        and isinstance(item.get("fields") or {}, dict)
     )
 
+
+async def _change_document_field(field):
+    # the single-field endpoints answer like PATCH /document for bad input
+    data = await request.get_json()
+
+    try:
+        result = await update_document_fields(
+            data["uid"], data["document_id"], {field: data[field]}
+        )
+    except (ValueError, InvalidId) as e:
+        return jsonify({"error": str(e)}), 400
+
+    if result["matched_count"] == 0:
+        return jsonify({"error": "Document not found"}), 404
+
     return jsonify(result)
 
 
-@user_bp.route("/change_document_sentences", methods=["POST"])
+@user_bp.route("/change_document_title", methods=["POST"])
 @async_authorization_required()
-async def change_document_sentences():
-    data = request.get_json()
-    user_id = data["uid"]
+async def change_document_title():
+    return await _change_document_field("title")
+
+
+@user_bp.route("/change_document_text", methods=["POST"])
+@async_authorization_required()
+async def change_document_text():
+    data = await request.get_json()
     document_id = data["document_id"]
-    sentences = data["sentences"]
+    ranking = int(data.get("ranking", Config.DEFAULT_RANKING))
 
-    mong_client = get_mongo_client()
+    db = get_mongo_client().get_database("readEase")
 
-    db = mong_client.get_database("readEase")
-    collection = db.get_collection("documents")
+    try:
+        writes = [
+            await _prepare_update(
+                db, data["uid"], document_id, {"text": data["text"]}, ranking
+            )
+        ]
+    except LookupError:
+        return jsonify({"error": "Document not found"}), 404
+    except InvalidId as e:
+        return jsonify({"error": str(e)}), 400
 
-    result = await collection.update_one(
-        {"user_id": user_id, "_id": document_id}, {"$set": {"sentences": sentences}}
-    )
+    result = await _apply_updates(db, writes)
 
-    return jsonify(result)
+    # the document can be deleted while its text is ranked
+    if result["matched_count"] == 0:
+        return jsonify({"error": "Document not found"}), 404
+
+    sentences = writes[0][1].get("sentences", [])
+
+    return jsonify({"document_id": document_id, "sentences": sentences}), 200
+
+
+@user_bp.route("/change_document_keywords", methods=["POST"])
+@async_authorization_required()
+async def change_document_keywords():
+    return await _change_document_field("keywords")
+
+
+@user_bp.route("/change_document_sentences", methods=["POST"])
+@async_authorization_required()
+async def change_document_sentences():
+    return await _change_document_field("sentences")
@@ -0,0 +1,55 @@
+# batching.py
+
+import random
+import asyncio
+
+
+def make_batches(items, max_items=None, max_tokens=None, max_bytes=None):
+    """
+    Splits texts into consecutive batches that respect every given limit:
+    texts per batch, estimated tokens and UTF-8 bytes. A text over a limit
+    on its own still gets a batch of its own.
+    """
+    batches = []
+    batch, tokens, size = [], 0, 0
+
+    for item in items:
+        # rough token estimate, about 4 characters per token
+        item_tokens = len(item) // 4 + 1
+        item_size = len(item.encode("utf-8")) if max_bytes else 0
+
+        full = bool(max_items) and len(batch) >= max_items
+        if max_tokens:
+            full = full or tokens + item_tokens > max_tokens
+        if max_bytes:
+            full = full or size + item_size > max_bytes
+
+        if batch and full:
+            batches.append(batch)
+            batch, tokens, size = [], 0, 0
+
+        batch.append(item)
+        tokens += item_tokens
+        size += item_size
+
+    if batch:
+        batches.append(batch)
+
+    return batches
+
+
+async def with_retries(call, retries, is_retryable):
+    """
+    Awaits call(), retrying the errors is_retryable accepts (429/5xx and
+    timeouts) up to retries times with jittered exponential backoff.
+    """
+    for attempt in range(retries + 1):
+        try:
+            return await call()
+        except Exception as e:
+            if attempt == retries or not is_retryable(e):
+                raise
+
+        # full jitter backoff: 0.5s, 1s, 2s ... capped at 8s
+        delay = min(8.0, 0.5 * 2**attempt)
+        await asyncio.sleep(random.uniform(0, delay))
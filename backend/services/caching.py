@@ -1,44 +1,210 @@
-import os
-from dotenv import load_dotenv
+import time
+import zlib
+import hashlib
+import asyncio
+import threading
+import weakref
+from collections import OrderedDict
 
+import msgpack
 import redis
-import json
+from redis.asyncio import Redis
+from redis.backoff import NoBackoff
+from redis.retry import Retry
+
+from config import Config
+
+
+class LRUCache:
+    """Thread-safe in-process LRU cache with an optional TTL per entry"""
+
+    def __init__(self, max_size, ttl=None):
+        self.max_size = max_size
+        self.ttl = ttl
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is None:
+                return default
+
+            expires_at, value = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._entries[key]
+                return default
+
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        ttl = ttl if ttl is not None else self.ttl
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+
+        return default if entry is None else entry[1]
+
+    def __len__(self):
+        return len(self._entries)
+
+
+# one client (and connection pool) per event loop, i.e. per worker process
+_clients = weakref.WeakKeyDictionary()
+_unavailable_until = 0.0
 
 
 def get_redis_client():
-    load_dotenv()
+    """
+    Shared async Redis client for the running event loop, or None while Redis
+    is marked unreachable so callers fall back to the in-process tier
+    without waiting on connection timeouts.
+    """
+    if time.monotonic() < _unavailable_until:
+        return None
+
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+
+    if client is None:
+        client = Redis.from_url(
+            Config.REDIS_URL,
+            max_connections=Config.REDIS_MAX_CONNECTIONS,
+            socket_connect_timeout=Config.REDIS_TIMEOUT,
+            socket_timeout=Config.REDIS_TIMEOUT,
+            retry=Retry(NoBackoff(), 0),
+        )
+        _clients[loop] = client
+
+    return client
+
+
+def redis_failed(error):
+    # skip redis for a while after a connection failure instead of paying the
+    # connect timeout on every request
+    global _unavailable_until
+
+    print(error)
+
+    if isinstance(error, (redis.exceptions.ConnectionError, redis.exceptions.TimeoutError)):
+        _unavailable_until = time.monotonic() + Config.REDIS_RETRY_AFTER
+
+
+def content_hash(*parts):
+    # stable across workers, unlike the builtin hash()
+    digest = hashlib.blake2b(digest_size=16)
+    for part in parts:
+        digest.update(str(part).encode("utf-8"))
+        digest.update(b"\0")
+
+    return digest.hexdigest()
+
 
-    if os.getenv("ENV") == "production":
-        pass
-    else:
-        return redis.Redis(host="localhost", port="6379")
+def pack(value):
+    return zlib.compress(msgpack.packb(value, use_bin_type=True))
 
 
-def cache_url(url, summarized_data):
+def unpack(data):
+    return msgpack.unpackb(zlib.decompress(data), raw=False)
+
+
+URL_TTL = 60 * 5  # 5 minutes
+
+# both tiers hold packed bytes, so every hit unpacks a fresh copy that the
+# caller may change without touching the cached entry
+_url_cache = LRUCache(Config.RESULT_CACHE_SIZE, ttl=URL_TTL)
+
+
+def url_key(url):
+    return f"url:{url}"
+
+
+async def cache_url(url, summarized_data):
+    key = url_key(url)
+    data = pack(summarized_data)
+    _url_cache.set(key, data)
+
     redis_client = get_redis_client()
 
     if redis_client:
-        redis_client.hset(
-            repr(url),
-            mapping={
-                "keywords": json.dumps(summarized_data["keywords"]),
-                "sentences": json.dumps(summarized_data["sentences"]),
-            },
-        )
-        redis_client.expire(url, 60 * 5)  # 5 minutes
+        try:
+            # set the value and its TTL on the same key in one round trip
+            async with redis_client.pipeline(transaction=True) as pipeline:
+                pipeline.hset(key, "data", data)
+                pipeline.expire(key, URL_TTL)
+                await pipeline.execute()
+        except redis.exceptions.RedisError as e:
+            redis_failed(e)
+
+
+async def retrieve_cache_url(url):
+    key = url_key(url)
+
+    cached = _url_cache.get(key)
+    if cached is not None:
+        return unpack(cached)
+
+    redis_client = get_redis_client()
+
+    if redis_client:
+        try:
+            data = await redis_client.hget(key, "data")
+        except redis.exceptions.RedisError as e:
+            redis_failed(e)
+            return None
+
+        if data:
+            _url_cache.set(key, data)
+            return unpack(data)
+
+    return None
+
+
+_result_cache = LRUCache(Config.RESULT_CACHE_SIZE, ttl=Config.RESULT_CACHE_TTL)
+
+
+async def cache_result(key, value, ttl=None):
+    ttl = ttl or Config.RESULT_CACHE_TTL
+    data = pack(value)
+    _result_cache.set(key, data, ttl=ttl)
+
+    redis_client = get_redis_client()
+
+    if redis_client:
+        try:
+            await redis_client.set(key, data, ex=int(ttl))
+        except redis.exceptions.RedisError as e:
+            redis_failed(e)
+
 
+async def retrieve_result(key):
+    cached = _result_cache.get(key)
+    if cached is not None:
+        return unpack(cached)
 
-def retrieve_cache_url(url):
     redis_client = get_redis_client()
 
     if redis_client:
+        try:
+            data = await redis_client.get(key)
+        except redis.exceptions.RedisError as e:
+            redis_failed(e)
+            return None
 
-        keywords = redis_client.hget(url, "keywords")
-        sentences = redis_client.hget(url, "sentences")
+        if data:
+            _result_cache.set(key, data)
+            return unpack(data)
 
-        if keywords and sentences:
-            return {
-                "keywords": json.loads(keywords.decode("utf-8")),
-                "sentences": json.loads(sentences.decode("utf-8")),
-            }
     return None
@@ -0,0 +1,81 @@
+# caching_test.py
+
+import os
+import sys
+import time
+import asyncio
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.caching import (
+    LRUCache,
+    pack,
+    unpack,
+    cache_url,
+    retrieve_cache_url,
+    cache_result,
+    retrieve_result,
+)
+
+
+class TestLRUCache(unittest.TestCase):
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache(max_size=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+
+        self.assertEqual(cache.get("a"), 1)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(len(cache), 2)
+
+    def test_entries_expire(self):
+        cache = LRUCache(max_size=2, ttl=0.01)
+        cache.set("a", 1)
+        cache.set("b", 2, ttl=60)
+        time.sleep(0.02)
+
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.get("b"), 2)
+
+
+class TestUrlCache(unittest.TestCase):
+    def test_pack_round_trip(self):
+        value = {"keywords": ["art"], "sentences": [["Art is expression.", 5]]}
+
+        self.assertEqual(unpack(pack(value)), value)
+
+    def test_front_tier_without_redis(self):
+        async def run():
+            with mock.patch("services.caching.get_redis_client", return_value=None):
+                await cache_url("https://example.com", {"keywords": [], "sentences": []})
+                return await retrieve_cache_url("https://example.com")
+
+        self.assertEqual(asyncio.run(run()), {"keywords": [], "sentences": []})
+
+    def test_callers_cannot_change_cached_entries(self):
+        async def run():
+            with mock.patch("services.caching.get_redis_client", return_value=None):
+                value = {"sentences": [["Art.", 5]]}
+                await cache_url("https://example.com/a", value)
+                await cache_result("result:a", value)
+
+                # the stored value and the copies handed out are all changed
+                value["sentences"] = ["Art."]
+                (await retrieve_cache_url("https://example.com/a"))["sentences"] = []
+                (await retrieve_result("result:a"))["sentences"] = []
+
+                return (
+                    await retrieve_cache_url("https://example.com/a"),
+                    await retrieve_result("result:a"),
+                )
+
+        for cached in asyncio.run(run()):
+            self.assertEqual(cached, {"sentences": [["Art.", 5]]})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,62 @@
+# database.py
+
+import os
+import asyncio
+
+import pymongo
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from config import Config
+
+# one client (and connection pool) per worker, shared by every request
+_client = None
+
+# seconds to wait for index creation before starting without it
+INDEX_TIMEOUT = 10
+
+
+def get_mongo_client():
+    global _client
+
+    if _client is None:
+        _client = AsyncIOMotorClient(
+            os.getenv("MONGO_URI"),
+            tlsAllowInvalidCertificates=True,
+            maxPoolSize=Config.MONGO_MAX_POOL_SIZE,
+            minPoolSize=Config.MONGO_MIN_POOL_SIZE,
+        )
+
+    return _client
+
+
+async def ensure_indexes():
+    db = get_mongo_client().get_database("readEase")
+
+    # serves both the {user_id} listing and the {user_id, _id} lookups
+    await db.get_collection("documents").create_index(
+        [("user_id", pymongo.ASCENDING), ("_id", pymongo.ASCENDING)],
+        name="user_id_id",
+    )
+    await db.get_collection("document_embeddings").create_index(
+        [("user_id", pymongo.ASCENDING), ("_id", pymongo.ASCENDING)],
+        name="user_id_id",
+    )
+
+
+async def connect_mongo():
+    # called at app startup: open the pool and make sure indexes exist
+    get_mongo_client()
+
+    try:
+        await asyncio.wait_for(ensure_indexes(), INDEX_TIMEOUT)
+    except (pymongo.errors.PyMongoError, asyncio.TimeoutError) as e:
+        # the app can still serve text processing without mongo
+        print(e)
+
+
+async def close_mongo():
+    global _client
+
+    if _client is not None:
+        _client.close()
+        _client = None
@@ -0,0 +1,188 @@
+# document_ranking.py
+
+import difflib
+
+import numpy as np
+from bson.binary import Binary
+
+from services.embeddings import get_embedding_provider
+from services.embedding_cache import embed_with_cache
+from services.ranking import rank_sentences
+
+
+def diff_sentences(old_sentences, new_sentences):
+    """
+    Returns (removed, added, kept): indices into old_sentences that are gone,
+    indices into new_sentences that are new, and (old, new) index pairs of
+    unchanged sentences. Cost scales with the edit since the common prefix
+    and suffix are skipped before diffing.
+    """
+    prefix = 0
+    limit = min(len(old_sentences), len(new_sentences))
+    while prefix < limit and old_sentences[prefix] == new_sentences[prefix]:
+        prefix += 1
+
+    suffix = 0
+    while (
+        suffix < limit - prefix
+        and old_sentences[-1 - suffix] == new_sentences[-1 - suffix]
+    ):
+        suffix += 1
+
+    old_middle = old_sentences[prefix : len(old_sentences) - suffix]
+    new_middle = new_sentences[prefix : len(new_sentences) - suffix]
+
+    removed, added = [], []
+    kept = [(i, i) for i in range(prefix)]
+
+    matcher = difflib.SequenceMatcher(a=old_middle, b=new_middle, autojunk=False)
+
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            kept += zip(
+                range(prefix + i1, prefix + i2), range(prefix + j1, prefix + j2)
+            )
+        else:
+            removed += range(prefix + i1, prefix + i2)
+            added += range(prefix + j1, prefix + j2)
+
+    old_end, new_end = len(old_sentences) - suffix, len(new_sentences) - suffix
+    kept += [(old_end + k, new_end + k) for k in range(suffix)]
+
+    return removed, added, kept
+
+
+def quantize_embeddings(embeddings):
+    """
+    Packs a float matrix as int8 rows with one float32 scale per row, about a
+    quarter of the float32 size. Returns a dict ready to store in Mongo.
+    """
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+
+    scales = np.abs(embeddings).max(axis=1) / 127 if len(embeddings) else np.zeros(0)
+    scales = np.where(scales == 0, 1.0, scales).astype(np.float32)
+    values = np.round(embeddings / scales[:, None]).astype(np.int8)
+
+    return {
+        "rows": int(embeddings.shape[0]),
+        "dimensions": int(embeddings.shape[1]) if embeddings.ndim == 2 else 0,
+        "values": Binary(values.tobytes()),
+        "scales": Binary(scales.tobytes()),
+    }
+
+
+def dequantize_embeddings(packed):
+    values = np.frombuffer(packed["values"], dtype=np.int8)
+    scales = np.frombuffer(packed["scales"], dtype=np.float32)
+
+    values = values.reshape(packed["rows"], packed["dimensions"])
+
+    return values.astype(np.float32) * scales[:, None]
+
+
+def _as_array(value, dtype):
+    # states written before binary packing stored plain lists
+    if isinstance(value, (bytes, bytearray)):
+        return np.frombuffer(value, dtype=dtype)
+
+    return np.asarray(value, dtype=dtype)
+
+
+def get_ranks(state):
+    """Rank of every stored sentence, in document order"""
+    return _as_array(state["ranks"], np.int8)
+
+
+def get_state_sentences(state, text):
+    """Sentences a ranking state was computed for, cut from the document text"""
+    if "sentences" in state:
+        # states written before offsets were stored kept a copy of every sentence
+        return state["sentences"]
+
+    offsets = _as_array(state["offsets"], np.int32).reshape(-1, 2)
+
+    return [text[start:end] for start, end in offsets]
+
+
+def get_ranked_sentences(state, text, ranking):
+    # precomputed ranks work for any threshold, no embedding needed
+    ranks = get_ranks(state)
+
+    return [
+        sentence
+        for sentence, rank in zip(get_state_sentences(state, text), ranks)
+        if rank >= int(ranking)
+    ]
+
+
+async def update_document_ranking(state, old_text, spans, stored_embeddings=None):
+    """
+    Re-ranks a stored document after its text changed.
+
+    state is the "ranking_state" saved with the document (or None): the
+    model, the (start, end) offsets of the sentences into old_text and their
+    ranks, or just a "stale" flag if the last ranking failed. spans are the
+    (sentence, start, end) tuples of the new text and stored_embeddings the
+    packed matrix of the previous sentences. Unchanged sentences reuse their
+    stored rows and only added ones are embedded. Returns the new state, the
+    rank of every sentence in document order, and the packed embeddings of
+    the new sentences.
+    """
+    provider = get_embedding_provider()
+    new_sentences = [sentence for sentence, _, _ in spans]
+
+    usable = state and not state.get("stale")
+
+    old_sentences = []
+    if usable and state.get("model") == provider.name:
+        old_sentences = get_state_sentences(state, old_text)
+    # otherwise: first ranking, a failed one, or the embedding model changed
+
+    old_embeddings = None
+    if (
+        old_sentences
+        and stored_embeddings
+        and stored_embeddings["rows"] == len(old_sentences)
+    ):
+        old_embeddings = dequantize_embeddings(stored_embeddings)
+
+    if old_embeddings is not None:
+        removed, added, kept = diff_sentences(old_sentences, new_sentences)
+
+        embeddings = np.zeros(
+            (len(new_sentences), old_embeddings.shape[1]), dtype=np.float32
+        )
+
+        if kept:
+            old_rows, new_rows = zip(*kept)
+            embeddings[list(new_rows)] = old_embeddings[list(old_rows)]
+
+        if added:
+            embeddings[added] = await embed_with_cache(
+                [new_sentences[j] for j in added], provider
+            )
+    else:
+        # nothing stored yet: unchanged sentences are embedding cache hits
+        embeddings = await embed_with_cache(new_sentences, provider)
+
+    ranks = np.zeros(len(new_sentences), dtype=np.int8)
+
+    if new_sentences:
+        # ranking touches every row anyway, so the centroid is summed afresh
+        # instead of carried over between edits
+        indices, scores, sorted_ranks = rank_sentences(
+            embeddings,
+            provider.buckets,
+            centroid=embeddings.sum(axis=0) / len(embeddings),
+        )
+        ranks[indices] = sorted_ranks
+
+    offsets = np.array([(start, end) for _, start, end in spans], dtype=np.int32)
+
+    new_state = {
+        "model": provider.name,
+        "offsets": Binary(offsets.tobytes()),
+        "ranks": Binary(ranks.tobytes()),
+    }
+
+    return new_state, ranks, quantize_embeddings(embeddings)
@@ -0,0 +1,173 @@
+# document_ranking_test.py
+
+import os
+import sys
+import asyncio
+import unittest
+from unittest import mock
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.embeddings import HashingEmbeddingProvider
+from services.sentencizer import split_sentences
+from services.document_ranking import (
+    dequantize_embeddings,
+    diff_sentences,
+    get_ranked_sentences,
+    get_state_sentences,
+    quantize_embeddings,
+    update_document_ranking,
+)
+
+TEXT = (
+    "Art is the expression of emotion through a medium. "
+    "The artist expresses emotion in the work of art. "
+    "Expression of emotion makes art different from craft. "
+    "The museum opens at nine."
+)
+
+
+class TestDiffSentences(unittest.TestCase):
+    def test_insert(self):
+        removed, added, kept = diff_sentences(["a", "b", "c"], ["a", "x", "b", "c"])
+
+        self.assertEqual(removed, [])
+        self.assertEqual(added, [1])
+        self.assertEqual(kept, [(0, 0), (1, 2), (2, 3)])
+
+    def test_delete(self):
+        removed, added, kept = diff_sentences(["a", "b", "c"], ["a", "c"])
+
+        self.assertEqual(removed, [1])
+        self.assertEqual(added, [])
+        self.assertEqual(kept, [(0, 0), (2, 1)])
+
+    def test_replace(self):
+        removed, added, kept = diff_sentences(["a", "b", "c"], ["a", "y", "c"])
+
+        self.assertEqual(removed, [1])
+        self.assertEqual(added, [1])
+        self.assertEqual(kept, [(0, 0), (2, 2)])
+
+    def test_from_and_to_empty(self):
+        self.assertEqual(diff_sentences([], ["a", "b"]), ([], [0, 1], []))
+        self.assertEqual(diff_sentences(["a", "b"], []), ([0, 1], [], []))
+
+
+class TestQuantize(unittest.TestCase):
+    def test_round_trip_error_is_within_half_a_step(self):
+        embeddings = np.random.default_rng(0).normal(size=(20, 64)).astype(np.float32)
+        restored = dequantize_embeddings(quantize_embeddings(embeddings))
+
+        step = np.abs(embeddings).max(axis=1, keepdims=True) / 127
+        self.assertEqual(restored.shape, embeddings.shape)
+        self.assertTrue(np.all(np.abs(restored - embeddings) <= step / 2 + 1e-6))
+
+    def test_zero_rows_and_empty_matrix(self):
+        restored = dequantize_embeddings(quantize_embeddings(np.zeros((2, 4))))
+        np.testing.assert_array_equal(restored, np.zeros((2, 4)))
+
+        packed = quantize_embeddings(np.zeros((0, 4)))
+        self.assertEqual(dequantize_embeddings(packed).shape, (0, 4))
+
+
+class TestUpdateDocumentRanking(unittest.TestCase):
+    def setUp(self):
+        self.provider = HashingEmbeddingProvider(dimensions=256)
+        self.calls = []
+
+        async def embed(sentences, provider):
+            self.calls.append(list(sentences))
+            return provider.embed(sentences)
+
+        for target, value in (
+            ("get_embedding_provider", lambda: self.provider),
+            ("embed_with_cache", embed),
+        ):
+            patcher = mock.patch(f"services.document_ranking.{target}", value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def update(self, state, old_text, text, stored=None):
+        return asyncio.run(
+            update_document_ranking(state, old_text, split_sentences(text), stored)
+        )
+
+    def test_empty_then_text_then_empty(self):
+        state, ranks, stored = self.update(None, "", "")
+        self.assertEqual(len(ranks), 0)
+        self.assertEqual(get_state_sentences(state, ""), [])
+
+        state, ranks, stored = self.update(state, "", TEXT, stored)
+        self.assertEqual(len(ranks), 4)
+        self.assertEqual(stored["rows"], 4)
+        self.assertEqual(
+            get_state_sentences(state, TEXT),
+            [sentence for sentence, _, _ in split_sentences(TEXT)],
+        )
+
+        state, ranks, stored = self.update(state, TEXT, "", stored)
+        self.assertEqual(len(ranks), 0)
+        self.assertEqual(stored["rows"], 0)
+        self.assertEqual(get_ranked_sentences(state, "", 0), [])
+
+    def test_only_added_sentences_are_embedded(self):
+        state, _, stored = self.update(None, "", TEXT)
+        self.calls.clear()
+
+        text = TEXT + " Emotion is what the artist puts into art."
+        state, ranks, stored = self.update(state, TEXT, text, stored)
+
+        self.assertEqual(self.calls, [["Emotion is what the artist puts into art."]])
+        self.assertEqual(len(ranks), 5)
+
+        # the centroid comes from the current rows, so an edit and a fresh
+        # ranking of the same text agree
+        _, fresh_ranks, _ = self.update(None, "", text)
+        np.testing.assert_array_equal(ranks, fresh_ranks)
+
+    def test_ranked_sentences_are_cut_from_the_text(self):
+        state, ranks, _ = self.update(None, "", TEXT)
+
+        sentences = get_ranked_sentences(state, TEXT, 0)
+        self.assertEqual(len(sentences), 4)
+        self.assertTrue(all(sentence in TEXT for sentence in sentences))
+        self.assertNotIn("sentences", state)
+
+    def test_model_change_resets_state(self):
+        state, _, stored = self.update(None, "", TEXT)
+        state["model"] = "another-model"
+        self.calls.clear()
+
+        state, _, _ = self.update(state, TEXT, TEXT, stored)
+
+        self.assertEqual(len(self.calls[0]), 4)
+        self.assertEqual(state["model"], self.provider.name)
+
+    def test_stale_state_is_ranked_from_scratch(self):
+        _, _, stored = self.update(None, "", TEXT)
+        self.calls.clear()
+
+        state, ranks, _ = self.update({"stale": True}, TEXT, TEXT, stored)
+
+        self.assertEqual(len(self.calls[0]), 4)
+        self.assertEqual(len(ranks), 4)
+
+    def test_states_with_stored_sentences_are_still_read(self):
+        state, ranks, stored = self.update(None, "", TEXT)
+        legacy = {
+            "model": state["model"],
+            "sentences": get_state_sentences(state, TEXT),
+            "ranks": state["ranks"],
+        }
+        self.calls.clear()
+
+        self.update(legacy, "", TEXT, stored)
+
+        self.assertEqual(self.calls, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,175 @@
+# embedding_cache.py
+
+import hashlib
+import threading
+import unicodedata
+
+import numpy as np
+import redis
+
+from config import Config
+from services.caching import LRUCache, get_redis_client, redis_failed
+from services.embeddings import get_embedding_provider, embed_sentences
+
+
+def normalize_sentence(sentence):
+    # whitespace and unicode form do not change the embedding, so they should
+    # not change the cache key either
+    return " ".join(unicodedata.normalize("NFC", sentence).split())
+
+
+def sentence_key(sentence, model_name):
+    digest = hashlib.blake2b(
+        f"{model_name}\0{normalize_sentence(sentence)}".encode("utf-8"),
+        digest_size=16,
+    ).hexdigest()
+
+    return f"emb:{digest}"
+
+
+class EmbeddingCache:
+    """
+    Sentence embedding cache shared across requests.
+
+    Lookups go to an in-process LRU first and then to Redis. Both tiers store
+    vectors as packed float16/float32 bytes. Only the sentences missing from
+    both tiers are sent to the embedding provider.
+    """
+
+    def __init__(self, max_size=5_000, ttl=60 * 60 * 24 * 7, dtype="float16"):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.dtype = np.dtype(dtype)
+
+        self._entries = LRUCache(max_size)
+        self._lock = threading.Lock()
+
+        self.memory_hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+
+    def _get_local(self, key):
+        value = self._entries.get(key)
+
+        return None if value is None else self._unpack(value)
+
+    def _set_local(self, key, vector):
+        self._entries.set(key, self._pack(vector))
+
+    def _pack(self, vector):
+        return vector.astype(self.dtype).tobytes()
+
+    def _unpack(self, value):
+        return np.frombuffer(value, dtype=self.dtype).astype(np.float32)
+
+    async def _get_remote(self, keys):
+        redis_client = get_redis_client()
+
+        if not redis_client or not keys:
+            return [None] * len(keys)
+
+        try:
+            values = await redis_client.mget(keys)
+        except redis.exceptions.RedisError as e:
+            redis_failed(e)
+            return [None] * len(keys)
+
+        return [None if value is None else self._unpack(value) for value in values]
+
+    async def _set_remote(self, items):
+        redis_client = get_redis_client()
+
+        if not redis_client or not items:
+            return
+
+        try:
+            async with redis_client.pipeline(transaction=False) as pipeline:
+                for key, vector in items:
+                    pipeline.set(key, self._pack(vector), ex=self.ttl)
+                await pipeline.execute()
+        except redis.exceptions.RedisError as e:
+            redis_failed(e)
+
+    async def get_or_embed(self, sentences, model_name, embed):
+        """
+        Returns a float32 matrix with one row per sentence, awaiting
+        embed(missing_sentences) only for sentences not found in the cache.
+        """
+        keys = [sentence_key(sentence, model_name) for sentence in sentences]
+        vectors = [self._get_local(key) for key in keys]
+
+        memory_hits = sum(vector is not None for vector in vectors)
+
+        # look up the remaining keys in redis, once per distinct key
+        remote_keys = list(dict.fromkeys(k for k, v in zip(keys, vectors) if v is None))
+        found = dict(zip(remote_keys, await self._get_remote(remote_keys)))
+
+        redis_hits = 0
+        for i, key in enumerate(keys):
+            if vectors[i] is None and found.get(key) is not None:
+                vectors[i] = found[key]
+                self._set_local(key, vectors[i])
+                redis_hits += 1
+
+        # embed each distinct missing sentence once, but count every
+        # occurrence as a miss like hits are counted
+        missing = {}
+        misses = 0
+        for i, key in enumerate(keys):
+            if vectors[i] is None:
+                missing.setdefault(key, sentences[i])
+                misses += 1
+
+        if missing:
+            embedded = await embed(list(missing.values()))
+            embedded = np.asarray(embedded, dtype=np.float32)
+            new_items = list(zip(missing.keys(), embedded))
+
+            for key, vector in new_items:
+                self._set_local(key, vector)
+            await self._set_remote(new_items)
+
+            embedded_by_key = dict(new_items)
+            for i, key in enumerate(keys):
+                if vectors[i] is None:
+                    vectors[i] = embedded_by_key[key]
+
+        with self._lock:
+            self.memory_hits += memory_hits
+            self.redis_hits += redis_hits
+            self.misses += misses
+
+        if not vectors:
+            return np.zeros((0, 0), dtype=np.float32)
+
+        return np.vstack(vectors)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.memory_hits + self.redis_hits + self.misses
+
+            return {
+                "memory_hits": self.memory_hits,
+                "redis_hits": self.redis_hits,
+                "misses": self.misses,
+                "hit_rate": (lookups - self.misses) / lookups if lookups else 0.0,
+                "size": len(self._entries),
+            }
+
+
+embedding_cache = EmbeddingCache(
+    max_size=Config.EMBEDDING_CACHE_SIZE,
+    ttl=Config.EMBEDDING_CACHE_TTL,
+    dtype=Config.EMBEDDING_CACHE_DTYPE,
+)
+
+
+async def embed_with_cache(sentences, provider=None):
+    """Embeds sentences, sending only cache misses to the provider"""
+    provider = provider or get_embedding_provider()
+
+    async def embed_uncached(missing_sentences):
+        # batches are sized to the provider limits and sent concurrently
+        return await embed_sentences(missing_sentences, provider)
+
+    return await embedding_cache.get_or_embed(sentences, provider.name, embed_uncached)
@@ -0,0 +1,79 @@
+# embedding_cache_test.py
+
+import os
+import sys
+import asyncio
+import unittest
+from unittest import mock
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.embedding_cache import EmbeddingCache, sentence_key
+
+
+class TestEmbeddingCache(unittest.TestCase):
+    def setUp(self):
+        # keep the tests on the in-process tier only
+        patcher = mock.patch("services.embedding_cache.get_redis_client")
+        patcher.start().return_value = None
+        self.addCleanup(patcher.stop)
+
+        self.cache = EmbeddingCache(max_size=3)
+        self.calls = []
+
+    async def embed(self, sentences):
+        self.calls.append(list(sentences))
+        return [[float(len(sentence)), 1.0] for sentence in sentences]
+
+    def get_or_embed(self, sentences, model_name, embed):
+        return asyncio.run(self.cache.get_or_embed(sentences, model_name, embed))
+
+    def test_key_ignores_whitespace_but_not_model(self):
+        self.assertEqual(sentence_key("a  b ", "m"), sentence_key("a b", "m"))
+        self.assertNotEqual(sentence_key("a b", "m"), sentence_key("a b", "n"))
+
+    def test_only_misses_are_embedded(self):
+        self.get_or_embed(["one", "three"], "m", self.embed)
+        vectors = self.get_or_embed(["three", "sixteen", "one"], "m", self.embed)
+
+        self.assertEqual(self.calls, [["one", "three"], ["sixteen"]])
+        np.testing.assert_array_equal(vectors[:, 0], [5.0, 7.0, 3.0])
+        self.assertEqual(vectors.dtype, np.float32)
+
+    def test_duplicates_are_embedded_once(self):
+        vectors = self.get_or_embed(["same", "same", "same "], "m", self.embed)
+
+        self.assertEqual(self.calls, [["same"]])
+        self.assertEqual(vectors.shape, (3, 2))
+
+    def test_lru_eviction_and_counters(self):
+        self.get_or_embed(["a", "b", "c", "d"], "m", self.embed)
+        self.get_or_embed(["a", "d"], "m", self.embed)
+
+        stats = self.cache.stats()
+        self.assertEqual(stats["size"], 3)
+        self.assertEqual(stats["memory_hits"], 1)
+        self.assertEqual(stats["misses"], 5)
+        self.assertEqual(self.calls[-1], ["a"])
+
+    def test_hits_and_misses_count_every_occurrence(self):
+        self.get_or_embed(["same", "same"], "m", self.embed)
+        self.get_or_embed(["same"], "m", self.embed)
+
+        stats = self.cache.stats()
+        self.assertEqual(stats["misses"], 2)
+        self.assertEqual(stats["memory_hits"], 1)
+        self.assertAlmostEqual(stats["hit_rate"], 1 / 3)
+
+    def test_entries_are_stored_packed(self):
+        self.get_or_embed(["one"], "m", self.embed)
+
+        packed = self.cache._entries.get(sentence_key("one", "m"))
+        self.assertIsInstance(packed, bytes)
+        self.assertEqual(len(packed), 2 * np.dtype("float16").itemsize)
+
+
+if __name__ == "__main__":
+    unittest.main()
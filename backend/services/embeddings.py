@@ -0,0 +1,208 @@
+# embeddings.py
+
+import os
+import re
+import zlib
+import asyncio
+from functools import lru_cache
+
+import numpy as np
+import google.generativeai as genai
+from google.api_core import exceptions as google_exceptions
+
+from config import Config
+from services.batching import make_batches, with_retries
+from services.gemini import get_gemini_client, get_gemini_async_client
+
+
+class EmbeddingProvider:
+    """Base class for the backends that turn sentences into embeddings"""
+
+    # identifies the model in cache keys and stored documents
+    name = "base"
+
+    # limits of a single call to the backend: sentences, estimated tokens
+    # and request payload in bytes
+    batch_size = 250
+    max_batch_tokens = None
+    max_batch_bytes = None
+
+    # cosine score thresholds used by scores_to_ranks for this model
+    buckets = [0.65, 0.7, 0.75, 0.8, 0.9]
+
+    def embed(self, sentences):
+        raise NotImplementedError
+
+    async def embed_async(self, sentences):
+        # local backends are CPU bound, keep them off the event loop
+        return await asyncio.to_thread(self.embed, sentences)
+
+    def is_retryable(self, error):
+        return False
+
+    def make_batches(self, sentences):
+        """Splits sentences into batches that respect every limit of the backend"""
+        return make_batches(
+            sentences, self.batch_size, self.max_batch_tokens, self.max_batch_bytes
+        )
+
+
+class GeminiEmbeddingProvider(EmbeddingProvider):
+    """Embeddings from the Gemini embedding API (network call per batch)"""
+
+    # the API accepts at most 100 texts per batch request
+    batch_size = 100
+    max_batch_tokens = 20_000
+    max_batch_bytes = 9 * 1024 * 1024
+
+    def __init__(self, model="models/text-embedding-004", api_key=None):
+        self.model = model
+        self.name = model
+        self.api_key = api_key or os.getenv("IAN_API_KEY")
+
+    def embed(self, sentences):
+        response = genai.embed_content(
+            model=self.model,
+            content=sentences,
+            client=get_gemini_client(self.api_key),
+        )
+
+        return response["embedding"]
+
+    async def embed_async(self, sentences):
+        response = await genai.embed_content_async(
+            model=self.model,
+            content=sentences,
+            client=get_gemini_async_client(self.api_key),
+        )
+
+        return response["embedding"]
+
+    def is_retryable(self, error):
+        # 429 (ResourceExhausted is a subclass) and any 5xx
+        return isinstance(
+            error, (google_exceptions.TooManyRequests, google_exceptions.ServerError)
+        )
+
+
+class HashingEmbeddingProvider(EmbeddingProvider):
+    """
+    In-process CPU embeddings using signed feature hashing of word unigrams
+    and bigrams. No model to load and no network, so it is safe to use on hot
+    pages and when the Gemini API is unavailable.
+    """
+
+    batch_size = 2048
+
+    # hashed bag-of-words vectors are much sparser than dense model
+    # embeddings, so similarity to the centroid sits lower (median ~0.33 on
+    # pdf-ocr/full_text.txt, so roughly half the sentences still rank 0)
+    buckets = [0.33, 0.38, 0.42, 0.46, 0.5]
+
+    token_pattern = re.compile(r"[a-z0-9]+")
+
+    def __init__(self, dimensions=1024):
+        self.dimensions = dimensions
+        self.name = f"hashing-{dimensions}"
+
+    @lru_cache(maxsize=2**16)
+    def _feature(self, token):
+        # crc32 is stable across processes, unlike the builtin hash()
+        digest = zlib.crc32(token.encode("utf-8"))
+        sign = 1.0 if digest & 1 else -1.0
+
+        return (digest >> 1) % self.dimensions, sign
+
+    def _features(self, sentence):
+        words = self.token_pattern.findall(sentence.lower())
+        tokens = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+        return [self._feature(token) for token in tokens]
+
+    def embed(self, sentences):
+        embeddings = np.zeros((len(sentences), self.dimensions), dtype=np.float32)
+
+        rows, columns, values = [], [], []
+        for i, sentence in enumerate(sentences):
+            for column, sign in self._features(sentence):
+                rows.append(i)
+                columns.append(column)
+                values.append(sign)
+
+        np.add.at(embeddings, (rows, columns), values)
+
+        # sublinear term frequency, then unit length
+        embeddings = np.sign(embeddings) * np.log1p(np.abs(embeddings))
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+
+        return embeddings / norms
+
+
+class SentenceTransformerEmbeddingProvider(EmbeddingProvider):
+    """In-process embeddings from a sentence-transformers model, loaded once"""
+
+    batch_size = 512
+    buckets = [0.45, 0.5, 0.55, 0.6, 0.7]
+
+    def __init__(self, model="all-MiniLM-L6-v2"):
+        # optional dependency, only needed when this provider is selected
+        from sentence_transformers import SentenceTransformer
+
+        self.name = model
+        self.model = SentenceTransformer(model, device="cpu")
+
+    def embed(self, sentences):
+        return self.model.encode(
+            sentences, convert_to_numpy=True, normalize_embeddings=True
+        )
+
+
+PROVIDERS = {
+    "gemini": GeminiEmbeddingProvider,
+    "hashing": HashingEmbeddingProvider,
+    "sentence-transformers": SentenceTransformerEmbeddingProvider,
+}
+
+
+@lru_cache(maxsize=None)
+def get_embedding_provider(name=None):
+    # one provider (and loaded model) per worker process
+    name = name or Config.EMBEDDING_PROVIDER
+
+    if name not in PROVIDERS:
+        raise ValueError(f"Unknown embedding provider: {name}")
+
+    if Config.EMBEDDING_MODEL and name != "hashing":
+        return PROVIDERS[name](model=Config.EMBEDDING_MODEL)
+
+    return PROVIDERS[name]()
+
+
+async def embed_sentences(sentences, provider=None):
+    """
+    Embeds sentences with batches dispatched concurrently, at most
+    EMBEDDING_CONCURRENCY in flight. Retryable failures (429/5xx) are retried
+    with jittered exponential backoff. Rows come back in the input order.
+    """
+    provider = provider or get_embedding_provider()
+    semaphore = asyncio.Semaphore(Config.EMBEDDING_CONCURRENCY)
+
+    async def embed_batch(batch):
+        async with semaphore:
+            return await with_retries(
+                lambda: provider.embed_async(batch),
+                Config.EMBEDDING_RETRIES,
+                provider.is_retryable,
+            )
+
+    # gather keeps results in batch order
+    results = await asyncio.gather(
+        *[embed_batch(batch) for batch in provider.make_batches(sentences)]
+    )
+
+    embeddings = []
+    for result in results:
+        embeddings += list(result)
+
+    return embeddings
@@ -0,0 +1,178 @@
+# embeddings_test.py
+
+import os
+import sys
+import asyncio
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.embeddings import (
+    PROVIDERS,
+    EmbeddingProvider,
+    HashingEmbeddingProvider,
+    embed_sentences,
+    get_embedding_provider,
+)
+
+
+class ProviderError(Exception):
+    def __init__(self, status):
+        super().__init__(f"{status} from provider")
+        self.status = status
+
+
+class FakeProvider(EmbeddingProvider):
+    """Embeds a sentence as [its number], later batches answering first"""
+
+    name = "fake"
+    batch_size = 3
+    max_batch_tokens = 10
+    max_batch_bytes = 40
+
+    def __init__(self, failures=()):
+        self.failures = list(failures)
+        self.batches = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def embed_async(self, sentences):
+        self.batches.append(list(sentences))
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+        try:
+            await asyncio.sleep(0.05 / len(self.batches))
+
+            if self.failures:
+                raise ProviderError(self.failures.pop(0))
+
+            return [[float(sentence.split()[-1])] for sentence in sentences]
+        finally:
+            self.in_flight -= 1
+
+    def is_retryable(self, error):
+        return error.status == 429 or error.status >= 500
+
+
+def embed(sentences, provider):
+    with mock.patch("services.batching.random.uniform", return_value=0):
+        return asyncio.run(embed_sentences(sentences, provider))
+
+
+class ModelProvider(EmbeddingProvider):
+    def __init__(self, model="default-model"):
+        self.name = model
+
+
+class TestGetEmbeddingProvider(unittest.TestCase):
+    def setUp(self):
+        get_embedding_provider.cache_clear()
+        self.addCleanup(get_embedding_provider.cache_clear)
+
+        patcher = mock.patch.dict(PROVIDERS, {"fake": ModelProvider})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_configured_provider_is_used(self):
+        with mock.patch("config.Config.EMBEDDING_PROVIDER", "hashing"):
+            provider = get_embedding_provider()
+
+        self.assertIsInstance(provider, HashingEmbeddingProvider)
+
+    def test_name_overrides_the_configured_provider(self):
+        with mock.patch("config.Config.EMBEDDING_PROVIDER", "hashing"), mock.patch(
+            "config.Config.EMBEDDING_MODEL", None
+        ):
+            self.assertEqual(get_embedding_provider("fake").name, "default-model")
+
+    def test_embedding_model_is_passed_to_the_provider(self):
+        with mock.patch("config.Config.EMBEDDING_MODEL", "other-model"):
+            self.assertEqual(get_embedding_provider("fake").name, "other-model")
+
+    def test_hashing_provider_ignores_embedding_model(self):
+        with mock.patch("config.Config.EMBEDDING_MODEL", "other-model"):
+            provider = get_embedding_provider("hashing")
+
+        self.assertEqual(provider.name, HashingEmbeddingProvider().name)
+
+    def test_one_provider_per_worker(self):
+        self.assertIs(get_embedding_provider("fake"), get_embedding_provider("fake"))
+
+    def test_unknown_provider(self):
+        with self.assertRaises(ValueError):
+            get_embedding_provider("missing")
+
+
+class TestMakeBatches(unittest.TestCase):
+    def test_sentence_cap(self):
+        batches = FakeProvider().make_batches([f"s {i}" for i in range(7)])
+
+        self.assertEqual([len(batch) for batch in batches], [3, 3, 1])
+
+    def test_token_cap(self):
+        # 4 characters per token: 5 tokens each, two fit in 10
+        batches = FakeProvider().make_batches(["x" * 16] * 5)
+
+        self.assertEqual([len(batch) for batch in batches], [2, 2, 1])
+
+    def test_byte_cap_counts_utf8(self):
+        # 10 characters but 20 bytes each, two fit in 40
+        batches = FakeProvider().make_batches(["é" * 10] * 3)
+
+        self.assertEqual([len(batch) for batch in batches], [2, 1])
+
+    def test_oversized_sentence_gets_its_own_batch(self):
+        batches = FakeProvider().make_batches(["a", "x" * 100, "b"])
+
+        self.assertEqual(batches, [["a"], ["x" * 100], ["b"]])
+
+
+class TestEmbedSentences(unittest.TestCase):
+    def test_rows_keep_the_input_order(self):
+        provider = FakeProvider()
+        sentences = [f"s {i}" for i in range(10)]
+
+        with mock.patch("config.Config.EMBEDDING_CONCURRENCY", 4):
+            rows = embed(sentences, provider)
+
+        self.assertEqual([row[0] for row in rows], list(range(10)))
+        self.assertEqual(len(provider.batches), 4)
+        self.assertGreater(provider.max_in_flight, 1)
+
+    def test_concurrency_is_capped(self):
+        provider = FakeProvider()
+
+        with mock.patch("config.Config.EMBEDDING_CONCURRENCY", 2):
+            embed([f"s {i}" for i in range(12)], provider)
+
+        self.assertEqual(provider.max_in_flight, 2)
+
+    def test_429_and_5xx_are_retried(self):
+        provider = FakeProvider(failures=[429, 503])
+
+        with mock.patch("config.Config.EMBEDDING_RETRIES", 3):
+            rows = embed(["s 1", "s 2"], provider)
+
+        self.assertEqual([row[0] for row in rows], [1, 2])
+        self.assertEqual(len(provider.batches), 3)
+
+    def test_other_errors_are_raised_at_once(self):
+        provider = FakeProvider(failures=[400])
+
+        with self.assertRaises(ProviderError):
+            embed(["s 1"], provider)
+        self.assertEqual(len(provider.batches), 1)
+
+    def test_gives_up_after_the_last_retry(self):
+        provider = FakeProvider(failures=[500] * 5)
+
+        with mock.patch("config.Config.EMBEDDING_RETRIES", 2):
+            with self.assertRaises(ProviderError):
+                embed(["s 1"], provider)
+        self.assertEqual(len(provider.batches), 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,32 @@
+# gemini.py
+
+import asyncio
+import weakref
+from functools import lru_cache
+
+import google.ai.generativelanguage as glm
+
+# every caller gets a client for its own API key: genai.configure sets one key
+# for the whole process, so the last caller to configure would win
+_async_clients = weakref.WeakKeyDictionary()
+
+
+@lru_cache(maxsize=None)
+def get_gemini_client(api_key):
+    """Blocking Gemini client for api_key, one per worker"""
+    return glm.GenerativeServiceClient(client_options={"api_key": api_key})
+
+
+def get_gemini_async_client(api_key):
+    """
+    Async Gemini client for api_key on the running event loop. gRPC channels
+    are bound to the loop they were opened on, so each loop gets its own.
+    """
+    clients = _async_clients.setdefault(asyncio.get_running_loop(), {})
+
+    if api_key not in clients:
+        clients[api_key] = glm.GenerativeServiceAsyncClient(
+            client_options={"api_key": api_key}
+        )
+
+    return clients[api_key]
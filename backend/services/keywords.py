@@ -0,0 +1,184 @@
+# keywords.py
+
+import re
+import math
+import asyncio
+import threading
+import unicodedata
+from collections import Counter, defaultdict
+
+import spacy
+from spacy.lang.en import English
+
+from config import Config
+from services.caching import content_hash, cache_result, retrieve_result
+from services.sentencizer import CHUNK_SIZE, chunk_text
+
+PUNCTUATION = re.compile(r"[^\w\s]")
+
+# entities are names of things, which make good keywords
+ENTITY_BOOST = 1.5
+
+_nlp = None
+_nlp_lock = threading.Lock()
+
+
+def get_keyword_nlp():
+    """
+    Pipeline used for keywords, loaded once per worker: KEYWORD_MODEL for
+    noun chunks and entities, or a blank English tokenizer (stop word
+    delimited phrases) when that model is not installed.
+    """
+    global _nlp
+
+    if _nlp is None:
+        with _nlp_lock:
+            if _nlp is None:
+                try:
+                    _nlp = spacy.load(Config.KEYWORD_MODEL, exclude=["lemmatizer"])
+                except OSError as e:
+                    print(e)
+                    _nlp = English()
+
+    return _nlp
+
+
+def _is_filler(token):
+    return token.is_stop or token.is_punct or token.is_space or token.like_num
+
+
+def _trim(tokens):
+    # drop leading and trailing determiners, pronouns, numbers and punctuation
+    start, end = 0, len(tokens)
+    while start < end and _is_filler(tokens[start]):
+        start += 1
+    while end > start and _is_filler(tokens[end - 1]):
+        end -= 1
+
+    return tokens[start:end]
+
+
+def _stop_word_phrases(doc):
+    # RAKE candidates: runs of content words between stop words and punctuation
+    phrase = []
+    for token in doc:
+        if _is_filler(token):
+            if phrase:
+                yield phrase, False
+            phrase = []
+        else:
+            phrase.append(token)
+
+    if phrase:
+        yield phrase, False
+
+
+def _candidates(doc):
+    """(tokens, is_entity) for every keyword candidate of doc"""
+    if not doc.has_annotation("DEP"):
+        yield from _stop_word_phrases(doc)
+        return
+
+    for chunk in doc.noun_chunks:
+        yield list(chunk), False
+
+    for entity in doc.ents:
+        if entity.label_ not in ("CARDINAL", "ORDINAL", "QUANTITY", "PERCENT"):
+            yield list(entity), True
+
+
+def extract_keywords(text, count=None):
+    """
+    The count best keywords of text, sorted alphabetically. Candidates are
+    noun chunks and entities (or stop word delimited phrases) of 1-3 words.
+    A phrase scores by how often it occurs times the mean log frequency of
+    its words across all candidates, favoring longer phrases by the square
+    root of their length.
+    """
+    count = count or Config.KEYWORD_COUNT
+    text = text[: Config.KEYWORD_MAX_CHARS]
+    nlp = get_keyword_nlp()
+
+    # paragraph aligned chunks, processed in batches
+    docs = nlp.pipe(
+        (text[start:end] for start, end in chunk_text(text, CHUNK_SIZE)),
+        batch_size=Config.SENTENCIZER_BATCH_SIZE,
+    )
+
+    occurrences = Counter()
+    surface_forms = defaultdict(Counter)
+    proper = defaultdict(lambda: True)
+    entities = set()
+    word_frequency = Counter()
+
+    for doc in docs:
+        for tokens, is_entity in _candidates(doc):
+            tokens = _trim(tokens)
+            words = [PUNCTUATION.sub("", token.text) for token in tokens]
+            words = [word for word in words if word]
+
+            if not 1 <= len(words) <= 3:
+                continue
+
+            phrase = " ".join(words)
+            key = phrase.lower()
+
+            occurrences[key] += 1
+            surface_forms[key][phrase] += 1
+
+            # keep capitals only for names: entities, proper nouns, or
+            # (without a tagger) phrases that are capitalized everywhere
+            if doc.has_annotation("TAG"):
+                is_proper = is_entity or all(token.pos_ == "PROPN" for token in tokens)
+            else:
+                is_proper = all(word[0].isupper() for word in words)
+            proper[key] = proper[key] and is_proper
+
+            if is_entity:
+                entities.add(key)
+
+            for word in key.split():
+                word_frequency[word] += 1
+
+    # count simple plurals with their singular ("emotions" -> "emotion")
+    for key in list(occurrences):
+        if key.endswith("s") and key[:-1] in occurrences:
+            occurrences[key[:-1]] += occurrences.pop(key)
+            surface_forms[key[:-1]].update(surface_forms.pop(key))
+
+    def score(key):
+        words = key.split()
+        specificity = sum(math.log1p(word_frequency[word]) for word in words)
+        boost = ENTITY_BOOST if key in entities else 1.0
+
+        return occurrences[key] * specificity / math.sqrt(len(words)) * boost
+
+    best = sorted(occurrences, key=lambda key: (-score(key), key))[:count]
+
+    keywords = [
+        surface_forms[key].most_common(1)[0][0] if proper[key] else key
+        for key in best
+    ]
+
+    return sorted(keywords, key=lambda keyword: keyword.lower())
+
+
+def keywords_key(text):
+    # bumping KEYWORDS_VERSION or switching models starts a fresh set of entries
+    text = unicodedata.normalize("NFC", text.replace("\r\n", "\n")).strip()
+    digest = content_hash(Config.KEYWORD_MODEL, text)
+
+    return f"keywords:{Config.KEYWORDS_VERSION}:{digest}"
+
+
+async def get_keywords(text):
+    """Keywords of text, cached by content so repeated pages skip spaCy"""
+    key = keywords_key(text)
+
+    keywords = await retrieve_result(key)
+    if keywords is None:
+        # parsing is CPU bound, keep it off the event loop
+        keywords = await asyncio.to_thread(extract_keywords, text)
+        await cache_result(key, keywords)
+
+    return keywords
@@ -0,0 +1,58 @@
+# keywords_test.py
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.keywords import extract_keywords, keywords_key
+
+TEXT = """
+The Iberian Peninsula lies in the south west of Europe. Spain covers most of
+the Iberian Peninsula, and Portugal covers the rest of it.
+
+Spain is a member of the European Union. The Atlantic Ocean borders Spain to
+the north west, and the Mediterranean Sea borders it to the east. The
+emotions of a traveller crossing the peninsula are part of its history, and
+the emotion of the landscape stays with every traveller.
+"""
+
+
+class TestExtractKeywords(unittest.TestCase):
+    def test_keywords_are_sorted_and_limited(self):
+        keywords = extract_keywords(TEXT, count=5)
+
+        self.assertEqual(len(keywords), 5)
+        self.assertEqual(keywords, sorted(keywords, key=str.lower))
+
+    def test_frequent_names_keep_their_capitals(self):
+        keywords = extract_keywords(TEXT, count=5)
+
+        self.assertIn("Iberian Peninsula", keywords)
+
+    def test_plurals_fold_into_singular(self):
+        keywords = extract_keywords(TEXT, count=20)
+
+        self.assertNotIn("emotions", keywords)
+
+    def test_stop_words_are_never_keywords(self):
+        keywords = extract_keywords(TEXT, count=20)
+
+        for keyword in keywords:
+            self.assertNotIn(keyword.lower(), ("the", "it", "of", "and"))
+
+    def test_empty_text(self):
+        self.assertEqual(extract_keywords(""), [])
+
+
+class TestKeywordsKey(unittest.TestCase):
+    def test_line_endings_and_whitespace_do_not_matter(self):
+        self.assertEqual(keywords_key("a\r\nb "), keywords_key("a\nb"))
+
+    def test_different_texts_differ(self):
+        self.assertNotEqual(keywords_key("a"), keywords_key("b"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,205 @@
+# local_ranking.py
+
+import re
+import math
+
+import numpy as np
+from scipy import sparse
+from spacy.lang.en.stop_words import STOP_WORDS
+
+from services.ranking import scores_to_ranks
+
+# engines that rank without any network call, selectable per request
+LOCAL_ENGINES = ("tfidf", "textrank")
+
+# local scores have no absolute scale, so ranks come from where a sentence
+# falls in its own document: below the median is rank 0, the top 3% rank 6.
+# A sentence's percentile is the share of sentences scoring strictly lower,
+# so tied scores all take the lowest percentile of their group
+RANK_QUANTILES = [0.5, 0.65, 0.8, 0.9, 0.97]
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+# sentences of fewer words (navigation, buttons, captions) are dropped first
+# by the cascade prefilter
+PREFILTER_MIN_WORDS = 4
+
+# a sentence whose similarity to every other sentence sums below this shares
+# no terms with the rest of the document
+DANGLING_DEGREE = 1e-9
+
+
+def tfidf_matrix(sentences):
+    """
+    Sparse sentence x term matrix with sublinear tf, smoothed idf and unit
+    length rows. Stop words are left out; a sentence made only of stop
+    words gets an empty row.
+    """
+    vocabulary = {}
+    rows, columns = [], []
+
+    for i, sentence in enumerate(sentences):
+        for token in TOKEN_PATTERN.findall(sentence.lower()):
+            if token in STOP_WORDS:
+                continue
+
+            rows.append(i)
+            columns.append(vocabulary.setdefault(token, len(vocabulary)))
+
+    shape = (len(sentences), max(len(vocabulary), 1))
+    counts = sparse.csr_matrix(
+        (np.ones(len(rows), dtype=np.float32), (rows, columns)), shape=shape
+    )
+    # duplicates were summed into term counts
+    counts.sum_duplicates()
+
+    document_frequency = np.bincount(counts.indices, minlength=shape[1])
+    idf = np.log((1 + shape[0]) / (1 + document_frequency)) + 1
+
+    counts.data = np.log1p(counts.data) * idf[counts.indices].astype(np.float32)
+
+    norms = np.sqrt(np.asarray(counts.multiply(counts).sum(axis=1)).ravel())
+    norms[norms == 0] = 1.0
+
+    return sparse.diags(1 / norms) @ counts
+
+
+def centroid_scores(matrix):
+    """Cosine similarity of every sentence to the document's TF-IDF centroid"""
+    centroid = np.asarray(matrix.mean(axis=0)).ravel()
+    norm = np.linalg.norm(centroid)
+
+    if norm == 0:
+        return np.zeros(matrix.shape[0], dtype=np.float32)
+
+    return (matrix @ (centroid / norm)).astype(np.float32)
+
+
+def _similarity_operator(matrix):
+    """x -> S x for the similarity graph S = M M^T without self loops"""
+    # float64: removing self loops subtracts nearly equal numbers
+    matrix = matrix.astype(np.float64)
+    transposed = matrix.T.tocsr()
+
+    # rows have unit length, or are empty
+    self_similarity = np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel()
+
+    def similarity_times(vector):
+        return matrix @ (transposed @ vector) - self_similarity * vector
+
+    return similarity_times
+
+
+def percentile_ranks(scores):
+    """
+    Ranks (0-6) of scores by their percentile within the document. Tied
+    scores share the percentile of the lowest of them, so a block of equal
+    low scores can never climb above the median.
+    """
+    below = np.searchsorted(np.sort(scores), scores, side="left") / len(scores)
+
+    # same precision as the buckets, so a percentile equal to one reaches it
+    below = below.astype(np.float32)
+
+    return scores_to_ranks(below, RANK_QUANTILES)
+
+
+def textrank_scores(matrix, damping=0.85, iterations=100, tolerance=1e-6):
+    """
+    TextRank over the cosine similarity graph of the sentences, by power
+    iteration. The graph S = M M^T (without self loops) is never built:
+    S x is computed as M (M^T x), so each step costs O(nonzeros of M).
+    """
+    count = matrix.shape[0]
+    if count == 0:
+        return np.zeros(0, dtype=np.float32)
+
+    similarity_times = _similarity_operator(matrix)
+
+    degree = similarity_times(np.ones(count))
+    dangling = degree <= DANGLING_DEGREE
+    degree[dangling] = 1.0
+
+    scores = np.full(count, 1 / count)
+
+    for _ in range(iterations):
+        # isolated sentences (fragments, navigation text) pass no weight on and
+        # keep only the base score, so they rank last
+        updated = (1 - damping) / count + damping * similarity_times(
+            scores / degree * ~dangling
+        )
+
+        converged = np.abs(updated - scores).sum() < tolerance
+        scores = updated
+        if converged:
+            break
+
+    return scores.astype(np.float32)
+
+
+def rank_sentences_locally(sentences, engine="tfidf"):
+    """
+    Ranks sentences without embeddings. Returns three arrays ordered by
+    decreasing score, like ranking.rank_sentences: sentence indices, scores
+    and ranks (0-6).
+    """
+    if engine not in LOCAL_ENGINES:
+        raise ValueError(f"Unknown ranking engine: {engine}")
+
+    if not sentences:
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty.astype(np.float32), empty.astype(np.int8)
+
+    matrix = tfidf_matrix(sentences)
+
+    if engine == "textrank":
+        scores = textrank_scores(matrix)
+        # isolated sentences (fragments, navigation text) are never relevant
+        relevant = _similarity_operator(matrix)(np.ones(len(sentences)))
+        relevant = relevant > DANGLING_DEGREE
+    else:
+        scores = centroid_scores(matrix)
+        relevant = scores > 0
+
+    ranks = percentile_ranks(scores)
+    ranks[~relevant] = 0
+
+    indices = np.argsort(-scores, kind="stable")
+
+    return indices, scores[indices], ranks[indices]
+
+
+def prefilter_scores(sentences):
+    """
+    Cheap relevance of every sentence: TF-IDF centroid similarity scaled by
+    the share of content (non stop) words. Fragments of fewer than
+    PREFILTER_MIN_WORDS words score -1, below any other sentence.
+    """
+    scores = centroid_scores(tfidf_matrix(sentences))
+
+    for i, sentence in enumerate(sentences):
+        words = TOKEN_PATTERN.findall(sentence.lower())
+
+        if len(words) < PREFILTER_MIN_WORDS:
+            scores[i] = -1
+        else:
+            content = sum(word not in STOP_WORDS for word in words)
+            scores[i] *= content / len(words)
+
+    return scores
+
+
+def prefilter_sentences(sentences, ratio):
+    """
+    Indices of the best `ratio` of sentences by prefilter_scores, in document
+    order: the candidates worth embedding in a cascade.
+    """
+    keep = max(1, math.ceil(len(sentences) * ratio))
+
+    if keep >= len(sentences):
+        return np.arange(len(sentences))
+
+    scores = prefilter_scores(sentences)
+    indices = np.argpartition(-scores, keep - 1)[:keep]
+
+    return np.sort(indices)
@@ -0,0 +1,112 @@
+# local_ranking_test.py
+
+import os
+import sys
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.local_ranking import (
+    percentile_ranks,
+    prefilter_scores,
+    prefilter_sentences,
+    rank_sentences_locally,
+    textrank_scores,
+    tfidf_matrix,
+)
+
+SENTENCES = [
+    "Art is the expression of emotion through a medium.",
+    "The artist expresses emotion in the work of art.",
+    "Expression of emotion makes art different from craft.",
+    "A craft follows a plan, while art expresses emotion.",
+    "Emotion that is expressed becomes art.",
+    "The museum opens at nine.",
+    "Click here to subscribe.",
+    "It was.",
+]
+
+
+class TestTfidf(unittest.TestCase):
+    def test_rows_are_unit_length_or_empty(self):
+        matrix = tfidf_matrix(SENTENCES)
+        norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+
+        np.testing.assert_allclose(norms, [1] * 7 + [0], atol=1e-5)
+
+
+class TestTextRank(unittest.TestCase):
+    def test_matches_dense_pagerank(self):
+        matrix = tfidf_matrix(SENTENCES[:5] * 2)
+
+        similarity = (matrix @ matrix.T).toarray()
+        np.fill_diagonal(similarity, 0)
+        transition = similarity / similarity.sum(axis=1, keepdims=True)
+
+        expected = np.full(len(similarity), 1 / len(similarity))
+        for _ in range(200):
+            expected = 0.15 / len(expected) + 0.85 * transition.T @ expected
+
+        np.testing.assert_allclose(textrank_scores(matrix), expected, atol=1e-5)
+
+
+class TestRankSentencesLocally(unittest.TestCase):
+    def test_off_topic_sentences_rank_lowest(self):
+        for engine in ("tfidf", "textrank"):
+            indices, scores, ranks = rank_sentences_locally(SENTENCES, engine)
+
+            # unrelated and empty sentences come last
+            self.assertEqual(set(indices[-3:]), {5, 6, 7})
+            self.assertTrue(np.all(np.diff(scores) <= 0))
+            self.assertTrue(np.all(ranks[-3:] == 0))
+            self.assertTrue(np.all((ranks >= 0) & (ranks <= 6)))
+
+    def test_tied_low_scores_stay_rank_0(self):
+        # one-word navigation fragments share no terms with anything, so they
+        # tie at the lowest scores
+        fragments = [f"Menu{i}." for i in range(22)]
+        body = [
+            f"Art expresses the emotion of the artist, example {i}." for i in range(20)
+        ]
+
+        for engine in ("tfidf", "textrank"):
+            indices, _, ranks = rank_sentences_locally(fragments + body, engine)
+            fragment_ranks = ranks[indices < len(fragments)]
+
+            self.assertTrue(np.all(fragment_ranks == 0), engine)
+            self.assertTrue(np.any(ranks[indices >= len(fragments)] > 0), engine)
+
+    def test_ties_share_the_lowest_percentile(self):
+        scores = np.array([0.1] * 6 + [0.5, 0.6, 0.7, 0.8], dtype=np.float32)
+
+        self.assertEqual(list(percentile_ranks(scores)), [0] * 6 + [2, 3, 4, 5])
+
+    def test_empty_and_unknown_engine(self):
+        self.assertEqual(len(rank_sentences_locally([])[0]), 0)
+
+        with self.assertRaises(ValueError):
+            rank_sentences_locally(SENTENCES, "llm")
+
+
+class TestPrefilter(unittest.TestCase):
+    def test_fragments_score_lowest(self):
+        scores = prefilter_scores(SENTENCES)
+
+        self.assertEqual(scores[7], -1)
+        self.assertTrue(np.all(scores[:5] > scores[5:].max()))
+
+    def test_keeps_the_best_ratio_in_document_order(self):
+        kept = prefilter_sentences(SENTENCES, 0.5)
+
+        self.assertEqual(len(kept), 4)
+        self.assertTrue(np.all(np.diff(kept) > 0))
+        self.assertTrue(set(kept) <= {0, 1, 2, 3, 4})
+
+    def test_ratio_of_one_keeps_everything(self):
+        np.testing.assert_array_equal(prefilter_sentences(SENTENCES, 1), range(8))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,53 @@
+# ranking.py
+
+import numpy as np
+
+
+def normalize_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+
+    return matrix / norms
+
+
+def scores_to_ranks(scores, buckets):
+    """
+    Maps cosine scores to ranks: a score below every bucket is rank 0,
+    otherwise the rank is one more than the number of buckets it reaches
+    (2 to 6).
+    """
+    reached = np.digitize(scores, np.sort(np.asarray(buckets, dtype=np.float32)))
+
+    return np.where(reached == 0, 0, reached + 1).astype(np.int8)
+
+
+def rank_sentences(embeddings, buckets, centroid=None, top_k=None):
+    """
+    Ranks sentence embeddings by cosine similarity to the document centroid.
+
+    Works on one contiguous float32 matrix and returns three arrays, ordered
+    by decreasing score: sentence indices, cosine scores and ranks (0-6).
+    When top_k is given only the k best sentences are returned.
+    """
+    matrix = np.ascontiguousarray(embeddings, dtype=np.float32)
+
+    if matrix.ndim != 2 or len(matrix) == 0:
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty.astype(np.float32), empty.astype(np.int8)
+
+    if centroid is None:
+        centroid = matrix.mean(axis=0)
+
+    centroid = normalize_rows(np.asarray(centroid, dtype=np.float32))
+    scores = normalize_rows(matrix) @ centroid
+
+    if top_k is not None and top_k < len(scores):
+        # only the k best need sorting
+        indices = np.argpartition(-scores, top_k - 1)[:top_k]
+        indices = indices[np.argsort(-scores[indices], kind="stable")]
+    else:
+        indices = np.argsort(-scores, kind="stable")
+
+    scores = scores[indices]
+
+    return indices, scores, scores_to_ranks(scores, buckets)
@@ -0,0 +1,68 @@
+# ranking_test.py
+
+import os
+import sys
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.ranking import rank_sentences, scores_to_ranks
+
+BUCKETS = [0.65, 0.7, 0.75, 0.8, 0.9]
+
+
+def loop_cosine_to_rank(cosine_score):
+    # the original per-sentence implementation
+    buckets = sorted(BUCKETS, reverse=True)
+
+    for i, bucket in enumerate(buckets):
+        if cosine_score >= bucket:
+            return 5 - i + 1
+
+    return 0
+
+
+class TestRanking(unittest.TestCase):
+    def test_ranks_match_loop_implementation(self):
+        scores = np.array([0.0, 0.64, 0.65, 0.7, 0.76, 0.8, 0.89, 0.9, 1.0], np.float32)
+
+        self.assertEqual(
+            list(scores_to_ranks(scores, BUCKETS)),
+            [loop_cosine_to_rank(score) for score in scores],
+        )
+
+    def test_sorted_by_decreasing_score(self):
+        rng = np.random.default_rng(0)
+        embeddings = rng.normal(size=(200, 16))
+
+        indices, scores, ranks = rank_sentences(embeddings, BUCKETS)
+
+        centroid = embeddings.mean(axis=0)
+        expected = embeddings @ centroid
+        expected /= np.linalg.norm(embeddings, axis=1) * np.linalg.norm(centroid)
+
+        self.assertEqual(sorted(indices), list(range(200)))
+        self.assertTrue(np.all(np.diff(scores) <= 0))
+        np.testing.assert_allclose(scores, expected[indices], atol=1e-5)
+
+    def test_top_k(self):
+        rng = np.random.default_rng(1)
+        embeddings = rng.normal(size=(500, 8))
+
+        all_indices, _, _ = rank_sentences(embeddings, BUCKETS)
+        top_indices, top_scores, top_ranks = rank_sentences(embeddings, BUCKETS, top_k=10)
+
+        self.assertEqual(list(top_indices), list(all_indices[:10]))
+        self.assertEqual(len(top_scores), 10)
+        self.assertEqual(len(top_ranks), 10)
+
+    def test_empty(self):
+        indices, scores, ranks = rank_sentences([], BUCKETS)
+
+        self.assertEqual(len(indices), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,133 @@
+# rate_limiting.py
+
+import math
+import time
+import threading
+
+import redis
+
+from config import Config
+from services.caching import LRUCache, get_redis_client, redis_failed
+
+# sliding window over two fixed windows: the previous window counts in
+# proportion to how much of it still overlaps the last `window` seconds
+SLIDING_WINDOW = """
+local current = tonumber(redis.call("get", KEYS[1]) or "0")
+local previous = tonumber(redis.call("get", KEYS[2]) or "0")
+local used = previous * tonumber(ARGV[3]) + current
+
+if used + tonumber(ARGV[2]) > tonumber(ARGV[1]) then
+    return {0, tostring(used)}
+end
+
+redis.call("incrby", KEYS[1], ARGV[2])
+redis.call("pexpire", KEYS[1], ARGV[4])
+return {1, tostring(used + tonumber(ARGV[2]))}
+"""
+
+
+def character_cost(*texts):
+    """Cost of processing texts: one unit per RATE_LIMIT_UNIT_CHARS characters"""
+    characters = sum(len(text) for text in texts)
+
+    return max(1, math.ceil(characters / Config.RATE_LIMIT_UNIT_CHARS))
+
+
+def client_address(forwarded_for, remote_addr):
+    """
+    Address a request came from. Only the X-Forwarded-For hop appended by the
+    outermost of TRUSTED_PROXIES proxies is believed, never the leftmost
+    entries, which the client can set to anything.
+    """
+    hops = [hop.strip() for hop in (forwarded_for or "").split(",") if hop.strip()]
+
+    if Config.TRUSTED_PROXIES <= 0 or len(hops) < Config.TRUSTED_PROXIES:
+        return remote_addr
+
+    return hops[-Config.TRUSTED_PROXIES]
+
+
+class SlidingWindowLimiter:
+    """
+    Hands out `limit` cost units per identity over any `window` seconds.
+
+    Counters live in Redis so every worker and container shares them. While
+    Redis is unreachable each worker falls back to its own counters.
+    """
+
+    def __init__(self, limit, window, local_size=10_000):
+        self.limit = limit
+        self.window = window
+
+        self._local = LRUCache(local_size, ttl=window * 2)
+        self._lock = threading.Lock()
+
+    def _keys(self, identity, now):
+        index = int(now // self.window)
+        # the hash tag keeps both windows on one cluster slot
+        return (
+            f"rate:{{{identity}}}:{index}",
+            f"rate:{{{identity}}}:{index - 1}",
+        )
+
+    def _retry_after(self, now):
+        return max(1, math.ceil(self.window - now % self.window))
+
+    async def hit(self, identity, cost):
+        """
+        Charges cost to identity. Returns (allowed, remaining, retry_after);
+        nothing is charged when the request is refused.
+        """
+        if self.limit <= 0:
+            return True, None, 0
+
+        # a request larger than the whole budget still runs on an idle window
+        cost = min(int(cost), self.limit)
+
+        now = time.time()
+        current_key, previous_key = self._keys(identity, now)
+        weight = 1 - (now % self.window) / self.window
+
+        redis_client = get_redis_client()
+
+        if redis_client:
+            try:
+                allowed, used = await redis_client.eval(
+                    SLIDING_WINDOW,
+                    2,
+                    current_key,
+                    previous_key,
+                    self.limit,
+                    cost,
+                    weight,
+                    int(self.window * 2000),
+                )
+                allowed, used = bool(allowed), float(used)
+            except redis.exceptions.RedisError as e:
+                redis_failed(e)
+                allowed, used = self._hit_local(current_key, previous_key, cost, weight)
+        else:
+            allowed, used = self._hit_local(current_key, previous_key, cost, weight)
+
+        remaining = max(0, int(self.limit - used))
+        retry_after = 0 if allowed else self._retry_after(now)
+
+        return allowed, remaining, retry_after
+
+    def _hit_local(self, current_key, previous_key, cost, weight):
+        with self._lock:
+            current = self._local.get(current_key, 0)
+            used = self._local.get(previous_key, 0) * weight + current
+
+            if used + cost > self.limit:
+                return False, used
+
+            self._local.set(current_key, current + cost)
+            return True, used + cost
+
+
+rate_limiter = SlidingWindowLimiter(
+    Config.RATE_LIMIT_CAPACITY,
+    Config.RATE_LIMIT_WINDOW,
+    local_size=Config.RATE_LIMIT_LOCAL_SIZE,
+)
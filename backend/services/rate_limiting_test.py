@@ -0,0 +1,85 @@
+# rate_limiting_test.py
+
+import os
+import sys
+import asyncio
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.rate_limiting import SlidingWindowLimiter, character_cost, client_address
+
+
+class TestCharacterCost(unittest.TestCase):
+    def test_cost_grows_with_text(self):
+        with mock.patch("config.Config.RATE_LIMIT_UNIT_CHARS", 100):
+            self.assertEqual(character_cost(""), 1)
+            self.assertEqual(character_cost("a" * 250), 3)
+            self.assertEqual(character_cost("a" * 150, "b" * 150), 3)
+
+
+class TestClientAddress(unittest.TestCase):
+    def test_forwarded_for_is_ignored_without_trusted_proxies(self):
+        with mock.patch("config.Config.TRUSTED_PROXIES", 0):
+            self.assertEqual(client_address("1.1.1.1", "10.0.0.1"), "10.0.0.1")
+
+    def test_only_the_trusted_hop_is_used(self):
+        with mock.patch("config.Config.TRUSTED_PROXIES", 1):
+            # the client prepended 1.1.1.1, our proxy appended 2.2.2.2
+            self.assertEqual(
+                client_address("1.1.1.1, 2.2.2.2", "10.0.0.1"), "2.2.2.2"
+            )
+            self.assertEqual(client_address(None, "10.0.0.1"), "10.0.0.1")
+
+        with mock.patch("config.Config.TRUSTED_PROXIES", 2):
+            self.assertEqual(
+                client_address("1.1.1.1, 2.2.2.2, 3.3.3.3", "10.0.0.1"), "2.2.2.2"
+            )
+            self.assertEqual(client_address("3.3.3.3", "10.0.0.1"), "10.0.0.1")
+
+
+class TestSlidingWindowLimiter(unittest.TestCase):
+    def hit(self, limiter, identity, cost):
+        async def run():
+            with mock.patch(
+                "services.rate_limiting.get_redis_client", return_value=None
+            ):
+                return await limiter.hit(identity, cost)
+
+        return asyncio.run(run())
+
+    def test_refuses_once_the_budget_is_spent(self):
+        limiter = SlidingWindowLimiter(limit=10, window=3600)
+
+        self.assertEqual(self.hit(limiter, "uid:a", 6)[:2], (True, 4))
+        self.assertTrue(self.hit(limiter, "uid:a", 4)[0])
+
+        allowed, remaining, retry_after = self.hit(limiter, "uid:a", 1)
+        self.assertFalse(allowed)
+        self.assertEqual(remaining, 0)
+        self.assertGreater(retry_after, 0)
+
+    def test_identities_are_limited_separately(self):
+        limiter = SlidingWindowLimiter(limit=5, window=3600)
+
+        self.assertTrue(self.hit(limiter, "uid:a", 5)[0])
+        self.assertTrue(self.hit(limiter, "uid:b", 5)[0])
+
+    def test_large_request_runs_on_an_idle_window(self):
+        limiter = SlidingWindowLimiter(limit=5, window=3600)
+
+        self.assertTrue(self.hit(limiter, "uid:a", 50)[0])
+        self.assertFalse(self.hit(limiter, "uid:a", 1)[0])
+
+    def test_local_counters_are_bounded(self):
+        limiter = SlidingWindowLimiter(limit=5, window=3600, local_size=4)
+
+        for i in range(10):
+            self.hit(limiter, f"uid:{i}", 1)
+
+        self.assertLessEqual(len(limiter._local), 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
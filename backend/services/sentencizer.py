@@ -0,0 +1,123 @@
+# sentencizer.py
+
+import re
+import threading
+
+from spacy.lang.en import English
+
+from config import Config
+
+# texts longer than this are split into chunks and run through nlp.pipe
+CHUNK_SIZE = 20_000
+
+PARAGRAPH_BREAK = re.compile(r"\n\s*\n")
+SENTENCE_END = re.compile(r"[.!?][\"')\]]*\s+")
+
+_nlp = None
+_nlp_lock = threading.Lock()
+
+
+def get_nlp():
+    # the pipeline is built once per worker and reused by every request
+    global _nlp
+
+    if _nlp is None:
+        with _nlp_lock:
+            if _nlp is None:
+                nlp = English()
+                nlp.add_pipe("sentencizer", first=True)
+                _nlp = nlp
+
+    return _nlp
+
+
+def _split_long_paragraph(text, start, end, chunk_size):
+    # cut at the last sentence end before the limit, or at whitespace
+    chunks = []
+
+    while end - start > chunk_size:
+        window = text[start : start + chunk_size]
+
+        cut = None
+        for match in SENTENCE_END.finditer(window):
+            cut = match.end()
+        if cut is None:
+            cut = window.rfind(" ") + 1 or chunk_size
+
+        chunks.append((start, start + cut))
+        start += cut
+
+    chunks.append((start, end))
+
+    return chunks
+
+
+def chunk_text(text, chunk_size=CHUNK_SIZE):
+    """
+    Returns (start, end) offsets of chunks of at most chunk_size characters,
+    cut at paragraph boundaries where possible.
+    """
+    if len(text) <= chunk_size:
+        return [(0, len(text))]
+
+    paragraphs = []
+    start = 0
+    for match in PARAGRAPH_BREAK.finditer(text):
+        paragraphs.append((start, match.start()))
+        start = match.end()
+    paragraphs.append((start, len(text)))
+
+    chunks = []
+    chunk_start, chunk_end = None, None
+
+    for start, end in paragraphs:
+        if end - start > chunk_size:
+            if chunk_start is not None:
+                chunks.append((chunk_start, chunk_end))
+                chunk_start = None
+            chunks += _split_long_paragraph(text, start, end, chunk_size)
+        elif chunk_start is None:
+            chunk_start, chunk_end = start, end
+        elif end - chunk_start > chunk_size:
+            chunks.append((chunk_start, chunk_end))
+            chunk_start, chunk_end = start, end
+        else:
+            chunk_end = end
+
+    if chunk_start is not None:
+        chunks.append((chunk_start, chunk_end))
+
+    return chunks
+
+
+def split_sentences(text, n_process=None):
+    """
+    Splits text into sentences, returned as (sentence, start, end) tuples
+    where start and end are character offsets into text.
+    """
+    nlp = get_nlp()
+    chunks = chunk_text(text)
+
+    if n_process is None:
+        # only book-sized inputs are worth the cost of extra processes
+        big = len(text) >= Config.SENTENCIZER_MULTIPROCESS_CHARS
+        n_process = Config.SENTENCIZER_PROCESSES if big else 1
+
+    docs = nlp.pipe(
+        (text[start:end] for start, end in chunks),
+        batch_size=Config.SENTENCIZER_BATCH_SIZE,
+        n_process=n_process,
+    )
+
+    sentences = []
+    for (offset, _), doc in zip(chunks, docs):
+        for sent in doc.sents:
+            sentences.append(
+                (sent.text, offset + sent.start_char, offset + sent.end_char)
+            )
+
+    return sentences
+
+
+def get_all_sentences(text):
+    return [sentence for sentence, _, _ in split_sentences(text)]
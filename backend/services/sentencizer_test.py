@@ -0,0 +1,92 @@
+# sentencizer_test.py
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.sentencizer import CHUNK_SIZE, chunk_text, split_sentences
+
+SENTENCES = [f"Sentence number {i} is about topic {i % 7}." for i in range(1500)]
+
+
+def paragraphs(sentences, size):
+    return [" ".join(sentences[i : i + size]) for i in range(0, len(sentences), size)]
+
+
+class TestChunkText(unittest.TestCase):
+    def assert_chunks_cover(self, text, chunks, chunk_size):
+        # in order, within the limit, and only whitespace between chunks
+        previous_end = 0
+        for start, end in chunks:
+            self.assertLessEqual(end - start, chunk_size)
+            self.assertEqual(text[previous_end:start].strip(), "")
+            previous_end = end
+
+        self.assertEqual(text[previous_end:].strip(), "")
+
+    def test_short_text_is_one_chunk(self):
+        self.assertEqual(chunk_text("One. Two.", chunk_size=100), [(0, 9)])
+
+    def test_paragraphs_are_packed_up_to_the_limit(self):
+        text = "\n\n".join(["a" * 30, "b" * 30, "c" * 30, "d" * 30])
+        chunks = chunk_text(text, chunk_size=70)
+
+        self.assertEqual(
+            [text[start:end] for start, end in chunks],
+            ["a" * 30 + "\n\n" + "b" * 30, "c" * 30 + "\n\n" + "d" * 30],
+        )
+
+    def test_long_paragraph_is_cut_after_a_sentence(self):
+        text = " ".join(SENTENCES[:20])
+        chunks = chunk_text(text, chunk_size=200)
+
+        self.assert_chunks_cover(text, chunks, 200)
+        for start, end in chunks[:-1]:
+            self.assertTrue(text[start:end].endswith(". "))
+
+    def test_paragraph_without_sentence_ends_is_cut_at_spaces(self):
+        text = " ".join(["word"] * 100)
+        chunks = chunk_text(text, chunk_size=42)
+
+        self.assert_chunks_cover(text, chunks, 42)
+        for start, end in chunks:
+            self.assertEqual(set(text[start:end].split()), {"word"})
+
+
+class TestSplitSentences(unittest.TestCase):
+    def assert_sentences(self, text, expected):
+        sentences = split_sentences(text, n_process=1)
+
+        for sentence, start, end in sentences:
+            self.assertEqual(text[start:end], sentence)
+
+        self.assertEqual([sentence.strip() for sentence, _, _ in sentences], expected)
+
+    def test_offsets_point_into_the_text(self):
+        text = "Art is expression.  It is made by people.\n\nArt has history."
+
+        self.assert_sentences(
+            text, ["Art is expression.", "It is made by people.", "Art has history."]
+        )
+
+    def test_text_longer_than_a_chunk(self):
+        text = "\n\n".join(paragraphs(SENTENCES, 10))
+        self.assertGreater(len(chunk_text(text)), 1)
+
+        self.assert_sentences(text, SENTENCES)
+
+    def test_no_sentence_is_cut_at_a_chunk_seam(self):
+        # one paragraph, so chunks are cut inside it after a sentence end
+        text = " ".join(SENTENCES)
+        self.assertGreater(len(text), CHUNK_SIZE)
+
+        self.assert_sentences(text, SENTENCES)
+
+    def test_empty_text(self):
+        self.assertEqual(split_sentences("", n_process=1), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
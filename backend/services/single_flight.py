@@ -0,0 +1,103 @@
+# single_flight.py
+
+import time
+import uuid
+import asyncio
+
+import redis
+
+from config import Config
+from services.caching import get_redis_client, redis_failed, unpack
+
+# computations running in this worker, by key
+_in_flight = {}
+
+# deletes the lock only if this worker still holds it
+RELEASE_LOCK = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+
+def _finished(key, task):
+    _in_flight.pop(key, None)
+
+    # mark the error as retrieved even if every caller went away
+    if not task.cancelled():
+        task.exception()
+
+
+async def single_flight(key, compute):
+    """
+    Runs compute() once for concurrent callers with the same key.
+
+    Callers in the same worker await the same in-flight task. Across workers
+    a Redis lock elects one worker to compute while the others poll the
+    result cache: compute must store its result under key with
+    caching.cache_result before returning. If Redis is down each worker
+    simply computes on its own.
+    """
+    task = _in_flight.get(key)
+
+    if task is None:
+        task = asyncio.ensure_future(_compute_across_workers(key, compute))
+        _in_flight[key] = task
+        task.add_done_callback(lambda done: _finished(key, done))
+
+    # one caller going away must not cancel the computation for the others
+    return await asyncio.shield(task)
+
+
+async def _compute_across_workers(key, compute):
+    redis_client = get_redis_client()
+
+    if not redis_client:
+        return await compute()
+
+    lock_key = f"flight:lock:{key}"
+    token = uuid.uuid4().hex
+
+    try:
+        cached = await redis_client.get(key)
+        if cached:
+            return unpack(cached)
+
+        acquired = await redis_client.set(
+            lock_key, token, nx=True, px=int(Config.SINGLE_FLIGHT_LOCK_TTL * 1000)
+        )
+    except redis.exceptions.RedisError as e:
+        redis_failed(e)
+        return await compute()
+
+    if acquired:
+        try:
+            # compute caches its result, which is what the waiters poll for
+            return await compute()
+        finally:
+            try:
+                await redis_client.eval(RELEASE_LOCK, 1, lock_key, token)
+            except redis.exceptions.RedisError as e:
+                redis_failed(e)
+
+    # another worker is computing, wait for its result
+    deadline = time.monotonic() + Config.SINGLE_FLIGHT_LOCK_TTL
+    delay = 0.05
+
+    try:
+        while time.monotonic() < deadline:
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 0.5)
+
+            cached = await redis_client.get(key)
+            if cached:
+                return unpack(cached)
+
+            # the holder gave up (error or timeout) without a result
+            if not await redis_client.exists(lock_key):
+                break
+    except redis.exceptions.RedisError as e:
+        redis_failed(e)
+
+    return await compute()
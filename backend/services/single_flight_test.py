@@ -0,0 +1,127 @@
+# single_flight_test.py
+
+import os
+import sys
+import asyncio
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.caching import pack
+from services.single_flight import single_flight, _in_flight
+
+
+class FakeRedis:
+    """The few commands single_flight uses, shared like one Redis server"""
+
+    def __init__(self):
+        self.values = {}
+
+    async def get(self, key):
+        return self.values.get(key)
+
+    async def set(self, key, value, nx=False, px=None, ex=None):
+        if nx and key in self.values:
+            return None
+
+        self.values[key] = value
+        return True
+
+    async def exists(self, key):
+        return int(key in self.values)
+
+    async def eval(self, script, numkeys, key, token):
+        # RELEASE_LOCK
+        if self.values.get(key) == token:
+            del self.values[key]
+            return 1
+
+        return 0
+
+
+class TestSingleFlight(unittest.TestCase):
+    def setUp(self):
+        self.redis = FakeRedis()
+        self.calls = 0
+
+        patcher = mock.patch(
+            "services.single_flight.get_redis_client", lambda: self.redis
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def compute(self, key, value="ranked", delay=0.01):
+        # like rank_and_cache_text: the result is cached under key
+        self.calls += 1
+        await asyncio.sleep(delay)
+        await self.redis.set(key, pack(value))
+
+        return value
+
+    def test_concurrent_callers_in_a_worker_share_one_run(self):
+        async def run():
+            return await asyncio.gather(
+                *[single_flight("a", lambda: self.compute("a")) for _ in range(5)]
+            )
+
+        self.assertEqual(asyncio.run(run()), ["ranked"] * 5)
+        self.assertEqual(self.calls, 1)
+        self.assertNotIn("a", _in_flight)
+        self.assertNotIn("flight:lock:a", self.redis.values)
+
+    def test_waits_for_the_result_of_another_worker(self):
+        async def run():
+            # another worker holds the lock and caches its result later
+            self.redis.values["flight:lock:b"] = "other-worker"
+
+            async def other_worker():
+                await asyncio.sleep(0.1)
+                await self.redis.set("b", pack("from other worker"))
+
+            result, _ = await asyncio.gather(
+                single_flight("b", lambda: self.compute("b")), other_worker()
+            )
+            return result
+
+        self.assertEqual(asyncio.run(run()), "from other worker")
+        self.assertEqual(self.calls, 0)
+
+    def test_computes_when_the_other_worker_gives_up(self):
+        async def run():
+            self.redis.values["flight:lock:c"] = "other-worker"
+
+            async def other_worker():
+                await asyncio.sleep(0.1)
+                del self.redis.values["flight:lock:c"]
+
+            result, _ = await asyncio.gather(
+                single_flight("c", lambda: self.compute("c")), other_worker()
+            )
+            return result
+
+        self.assertEqual(asyncio.run(run()), "ranked")
+        self.assertEqual(self.calls, 1)
+
+    def test_errors_reach_every_caller_and_release_the_lock(self):
+        async def failing():
+            self.calls += 1
+            await asyncio.sleep(0.01)
+            raise RuntimeError("provider down")
+
+        async def run():
+            return await asyncio.gather(
+                *[single_flight("d", failing) for _ in range(3)],
+                return_exceptions=True,
+            )
+
+        results = asyncio.run(run())
+
+        self.assertTrue(all(isinstance(result, RuntimeError) for result in results))
+        self.assertEqual(self.calls, 1)
+        self.assertNotIn("d", _in_flight)
+        self.assertNotIn("flight:lock:d", self.redis.values)
+
+
+if __name__ == "__main__":
+    unittest.main()
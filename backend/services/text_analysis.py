@@ -1,81 +1,285 @@
 # text_analysis.py
 
-import unittest
 import os
 import ast
+import json
+import asyncio
+import logging
+from functools import lru_cache
 
-from dotenv import load_dotenv
 import google.generativeai as genai
+from google.api_core import exceptions as google_exceptions
 
-# jwt imports
-
-
-async def generate_analysis(text):
-
-    # Configure the API with the key
-    load_dotenv()
-    genai.configure(api_key=os.getenv("API_KEY"))
-    model = genai.GenerativeModel("gemini-1.5-pro")
-
-    """Helper method to generate analysis using the Gemini model"""
-    prompt = f""" 
-        Analyze the text below and rank each sentence based on its relevance in conveying information. Follow these specific instructions:
-
-        1. **Keywords extraction rules**:
-        - Extract the most important keywords or phrases that capture the core ideas of the text.
-        - Each keyword should be 1-3 words maximum.
-        - Include only nouns, proper names, and technical terms.
-        - Exclude common words and generic verbs.
-        - Keywords should be lowercase unless they are proper nouns.
-        - Sort keywords alphabetically.
-        - Remove any punctuation from keywords.
-        - **Examples**:
-            - Valid: "machine learning," "Einstein," "global warming."
-            - Invalid: "is," "run," "quickly."
-
-        2. **Relevance ranking for sentences**:
-        - **Rank each sentence on a scale of 1-5** based on how much information it provides:
-            - **1 (Lowest)**: The sentence provides little to no new information or is overly generic.
-            - **2**: The sentence offers some relevant details but lacks strong relevance or uniqueness.
-            - **3**: The sentence provides useful information but is not essential to understanding the core text.
-            - **4**: The sentence conveys important information and contributes significantly to understanding the text.
-            - **5 (Highest)**: The sentence is highly critical, providing key insights or central ideas.
-        - **Consider embedded or compound sentences**:
-            - If a sentence contains multiple pieces of information separated by conjunctions or commas, evaluate each component independently.
-            - Extract the embedded sentence or phrase if it conveys a distinct and important idea, treating it as a separate sentence.
-            - Example: *"The sky is blue, and the sun is shining"* contains two parts: *"The sky is blue"* and *"The sun is shining."* Each should be evaluated and ranked separately.
-
-        3. **Output format**:
-        - Return the results as a Python dictionary in this exact format:
-        ```python
-        {{
-            "keywords": [
-                "keyword1",
-                "keyword2",
-                "keyword3"
-            ],
-            "sentences": [
-                ["sentence 1", 1],
-                ["sentence 2", 3],
-                ["sentence 3", 5]
-            ]
-        }}
-        ```
-
-        4. **Examples**:
-        - **1 (Lowest)**: *"The sky is blue."* (Generic, not critical to the text's meaning.)
-        - **2**: *"The experiment produced unexpected results, but further analysis is needed."* (Somewhat relevant but not highly informative.)
-        - **3**: *"During the late 19th century, economic reforms shaped industrial growth."* (Useful context but not the main focus.)
-        - **4**: *"The discovery of penicillin marked the beginning of the antibiotic era in medicine."* (Important contribution to the topic.)
-        - **5 (Highest)**: *"DNA's double-helix structure, discovered in 1953, revolutionized biology and genetics."* (Central to understanding the subject.)
-
-        **Note**:
-        The extracted sentences and keywords should work together to provide a clear understanding of the main idea of the passage. Ensure consistency in applying ranking criteria, and include all relevant embedded ideas as individual sentences where applicable.
-
-        **Text to analyze**: {text}
-    """
-    response = model.generate_content(prompt)
-    raw_text = response.text.strip()
+from config import Config
+from services.batching import make_batches, with_retries
+from services.gemini import get_gemini_async_client
+from services.sentencizer import split_sentences
+
+logger = logging.getLogger(__name__)
+
+
+class UnparsableAnswer(ValueError):
+    """The model answered without any of the requested entries"""
+
+
+class LLMClient:
+    """
+    Base class for the chat models used for text analysis. A client is built
+    once per worker and every call is awaited on the event loop, so a slow
+    completion only holds up its own request.
+    """
+
+    name = "base"
+
+    def __init__(self, timeout=None):
+        self.timeout = timeout or Config.LLM_TIMEOUT
+
+    async def _generate(self, prompt, **options):
+        raise NotImplementedError
+
+    async def generate(self, prompt, timeout=None, **options):
+        """
+        Text of the model's answer to prompt. Raises asyncio.TimeoutError after
+        timeout seconds; cancelling the caller cancels the request.
+        """
+        return await asyncio.wait_for(
+            self._generate(prompt, **options), timeout or self.timeout
+        )
+
+    def _stream(self, prompt, **options):
+        raise NotImplementedError
+
+    def is_retryable(self, error):
+        # timeouts and unparsable answers, backends add their 429/5xx errors
+        return isinstance(error, (asyncio.TimeoutError, UnparsableAnswer))
+
+    async def stream(self, prompt, timeout=None, **options):
+        """
+        Yields the text of the answer as the model produces it. The whole
+        stream must finish within timeout seconds.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + (timeout or self.timeout)
+        chunks = self._stream(prompt, **options)
+
+        try:
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(
+                        chunks.__anext__(), deadline - loop.time()
+                    )
+                except StopAsyncIteration:
+                    return
+
+                yield chunk
+        finally:
+            await chunks.aclose()
+
+
+class GeminiClient(LLMClient):
+    """Gemini through the async generate_content API"""
+
+    def __init__(self, model="gemini-1.5-pro", api_key=None, timeout=None):
+        super().__init__(timeout)
+        self.name = model
+        self.api_key = api_key or Config.API_KEY
+
+        self._model = genai.GenerativeModel(model)
+
+    @property
+    def model(self):
+        # GenerativeModel has no client argument, its own key is set here
+        # rather than through the process-wide genai.configure
+        self._model._async_client = get_gemini_async_client(self.api_key)
+
+        return self._model
+
+    async def _generate(self, prompt, **options):
+        response = await self.model.generate_content_async(
+            prompt, generation_config=options or None
+        )
+
+        return response.text
+
+    async def _stream(self, prompt, **options):
+        response = await self.model.generate_content_async(
+            prompt, generation_config=options or None, stream=True
+        )
+
+        async for chunk in response:
+            yield chunk.text
+
+    def is_retryable(self, error):
+        # 429 (ResourceExhausted is a subclass) and any 5xx
+        return super().is_retryable(error) or isinstance(
+            error, (google_exceptions.TooManyRequests, google_exceptions.ServerError)
+        )
+
+
+class GroqClient(LLMClient):
+    """Models served by Groq, through its async chat completions client"""
+
+    def __init__(self, model="llama-3.3-70b-versatile", api_key=None, timeout=None):
+        super().__init__(timeout)
+        self.name = model
+
+        # optional dependency, only needed when this client is selected
+        from groq import AsyncGroq
+
+        self.client = AsyncGroq(api_key=api_key or os.getenv("GROQ_API_KEY"))
+
+    async def _generate(self, prompt, **options):
+        completion = await self.client.chat.completions.create(
+            messages=[{"role": "user", "content": prompt}],
+            model=self.name,
+            **options,
+        )
+
+        return completion.choices[0].message.content
+
+    async def _stream(self, prompt, **options):
+        completion = await self.client.chat.completions.create(
+            messages=[{"role": "user", "content": prompt}],
+            model=self.name,
+            stream=True,
+            **options,
+        )
+
+        async for chunk in completion:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+    def is_retryable(self, error):
+        import groq
+
+        if isinstance(error, groq.APIStatusError):
+            return error.status_code == 429 or error.status_code >= 500
+
+        return super().is_retryable(error) or isinstance(error, groq.APITimeoutError)
+
+
+CLIENTS = {
+    "gemini": GeminiClient,
+    "groq": GroqClient,
+}
+
+
+@lru_cache(maxsize=None)
+def get_llm_client(name="gemini", model=None):
+    # one configured client (and connection pool) per worker and model
+    if name not in CLIENTS:
+        raise ValueError(f"Unknown LLM client: {name}")
+
+    if model:
+        return CLIENTS[name](model=model)
+
+    return CLIENTS[name]()
+
+
+class AnalysisStreamParser:
+    """
+    Incremental, tolerant parser for the dictionary the model returns. Text is
+    fed as it streams in, and every element of the "keywords", "sentences"
+    and "ranks" lists is returned as (key, value) as soon as it is complete.
+    Surrounding prose, code fences and a truncated tail are ignored.
+    """
+
+    keys = ("keywords", "sentences", "ranks")
+
+    def __init__(self):
+        self.buffer = ""
+        self.position = 0
+
+        # open containers: ("{", None) or ("[", key of the list)
+        self.stack = []
+        self.quote = None
+        self.escaped = False
+        self.string_start = None
+        self.last_string = None
+        self.element_start = None
+
+    def _target(self):
+        # key of the list the parser is directly inside, if it is wanted
+        if self.stack and self.stack[-1][0] == "[" and self.stack[-1][1] in self.keys:
+            return self.stack[-1][1]
+
+        return None
+
+    @staticmethod
+    def _literal(text):
+        try:
+            return json.loads(text)
+        except ValueError:
+            pass
+
+        try:
+            return ast.literal_eval(text)
+        except (SyntaxError, ValueError):
+            return None
+
+    def feed(self, text):
+        self.buffer += text
+        entries = []
+
+        while self.position < len(self.buffer):
+            char = self.buffer[self.position]
+
+            if self.quote:
+                if self.escaped:
+                    self.escaped = False
+                elif char == "\\":
+                    self.escaped = True
+                elif char == self.quote:
+                    self.quote = None
+                    literal = self.buffer[self.string_start : self.position + 1]
+                    self.last_string = self._literal(literal)
+
+                    # a string directly in a wanted list is a whole element
+                    key = self._target()
+                    if key and self.element_start is None:
+                        entries.append((key, self.last_string))
+            elif not self.stack and char != "{":
+                # prose or a code fence before the dictionary
+                pass
+            elif char in "\"'":
+                self.quote = char
+                self.string_start = self.position
+            elif char == "{":
+                self.stack.append(("{", None))
+            elif char == "[":
+                key = None
+                if self.stack and self.stack[-1][0] == "{":
+                    key = self.last_string
+
+                if self._target() and self.element_start is None:
+                    self.element_start = self.position
+
+                self.stack.append(("[", key))
+            elif char in "]}":
+                if self.stack:
+                    self.stack.pop()
+
+                # closing a list element of a wanted list
+                key = self._target()
+                if key and self.element_start is not None and char == "]":
+                    value = self._literal(
+                        self.buffer[self.element_start : self.position + 1]
+                    )
+                    if value is not None:
+                        entries.append((key, value))
+                    self.element_start = None
+
+            self.position += 1
+
+        return entries
+
+
+def parse_analysis(raw_text):
+    """
+    Parses the dictionary the model was asked to return. Output that does not
+    parse as a whole keeps its complete entries, or comes back empty.
+    """
+    raw_text = raw_text.strip()
 
     # Remove code block markers if present
     if raw_text.startswith("```") and raw_text.endswith("```"):
@@ -83,11 +287,239 @@ async def generate_analysis(text):
         if raw_text.startswith("python"):
             raw_text = raw_text[6:].strip()
 
-    print(raw_text)
-
     try:
         # Use ast.literal_eval instead of eval for safety
         return ast.literal_eval(raw_text)
     except (SyntaxError, ValueError):
-        # If parsing fails, return empty results
-        return {"keywords": [], "sentences": []}
+        pass
+
+    # truncated or malformed: keep every entry that was fully received
+    result = {"keywords": [], "sentences": []}
+    for key, value in AnalysisStreamParser().feed(raw_text):
+        result.setdefault(key, []).append(value)
+
+    return result
+
+
+def merge_keywords(keywords):
+    """Keywords of every group, deduplicated and sorted"""
+    return sorted(dict.fromkeys(keywords), key=lambda keyword: keyword.lower())
+
+
+async def _analyze_with_retries(analyze, client, semaphore):
+    """
+    Awaits analyze(), retrying the errors client.is_retryable accepts. None
+    once those retries run out, other errors are raised.
+    """
+    async with semaphore:
+        try:
+            return await with_retries(analyze, Config.LLM_RETRIES, client.is_retryable)
+        except Exception as e:
+            if not client.is_retryable(e):
+                raise
+
+            # the group is left unranked, the other groups still count
+            logger.warning("Giving up on a sentence group: %r", e)
+            return None
+
+
+INDEXED_PROMPT = """
+    Rank each numbered sentence below based on its relevance in conveying information and extract the keywords of the text. Follow these specific instructions:
+
+    1. **Keywords extraction rules**:
+    - Extract the most important keywords or phrases that capture the core ideas of the text.
+    - Each keyword should be 1-3 words maximum.
+    - Include only nouns, proper names, and technical terms.
+    - Keywords should be lowercase unless they are proper nouns.
+
+    2. **Relevance ranking for sentences**:
+    - **Rank each sentence on a scale of 1-5** based on how much information it provides:
+        - **1 (Lowest)**: The sentence provides little to no new information or is overly generic.
+        - **3**: The sentence provides useful information but is not essential to understanding the core text.
+        - **5 (Highest)**: The sentence is highly critical, providing key insights or central ideas.
+
+    3. **Output format**:
+    - Do not repeat the sentences. Refer to each one by its number only.
+    - Return JSON in this exact format, with one [number, rank] pair per sentence:
+    {{
+        "keywords": ["keyword1", "keyword2"],
+        "ranks": [[0, 3], [1, 5], [2, 1]]
+    }}
+
+    **Sentences to rank**:
+{sentences}
+"""
+
+
+def indexed_groups(sentences, max_tokens):
+    """
+    (first_index, group) for consecutive groups of about max_tokens tokens.
+    Indices stay global across groups, so merging answers needs no text
+    matching.
+    """
+    groups = make_batches(sentences, max_tokens=max_tokens)
+
+    first_indices = [0]
+    for group in groups[:-1]:
+        first_indices.append(first_indices[-1] + len(group))
+
+    return list(zip(first_indices, groups))
+
+
+def indexed_prompt(first_index, group):
+    # one sentence per line, whatever whitespace it spans in the text
+    numbered = "\n".join(
+        f"{first_index + i}: {' '.join(sentence.split())}"
+        for i, sentence in enumerate(group)
+    )
+
+    return INDEXED_PROMPT.format(sentences=numbered)
+
+
+def parse_indexed_ranks(result, first_index, count):
+    """
+    Maps the [index, rank] pairs of one answer to {index: rank}, ignoring
+    indices outside the group and clamping ranks to 1-5.
+    """
+    ranks = {}
+
+    for pair in result.get("ranks") or []:
+        try:
+            index, rank = int(pair[0]), int(pair[1])
+        except (TypeError, ValueError, IndexError):
+            continue
+
+        if first_index <= index < first_index + count:
+            ranks[index] = min(5, max(1, rank))
+
+    return ranks
+
+
+async def generate_indexed_analysis(text, client=None, chunk_tokens=None):
+    """
+    Ranks the sentences of text by sending them numbered and asking only for
+    [index, rank] pairs and keywords, so the model does not echo the text.
+    Returns {"keywords", "sentences"} where each sentence is
+    [sentence, rank, start, end] in document order, start and end being
+    character offsets into text. Sentences the model skipped get rank 0.
+    """
+    client = client or get_llm_client("gemini", "gemini-1.5-pro")
+    chunk_tokens = chunk_tokens or Config.LLM_CHUNK_TOKENS
+    semaphore = asyncio.Semaphore(Config.LLM_CONCURRENCY)
+
+    sentences = await asyncio.to_thread(split_sentences, text)
+
+    async def rank_group(first_index, group):
+        raw_text = await client.generate(indexed_prompt(first_index, group))
+
+        result = parse_analysis(raw_text)
+        ranks = parse_indexed_ranks(result, first_index, len(group))
+
+        if not ranks:
+            raise UnparsableAnswer(raw_text[:100])
+
+        return {"keywords": result.get("keywords") or [], "ranks": ranks}
+
+    groups = indexed_groups([sentence for sentence, _, _ in sentences], chunk_tokens)
+
+    results = await asyncio.gather(
+        *[
+            _analyze_with_retries(
+                lambda first=first, group=group: rank_group(first, group),
+                client,
+                semaphore,
+            )
+            for first, group in groups
+        ]
+    )
+
+    ranks, keywords = {}, []
+    for result in results:
+        if result is not None:
+            ranks.update(result["ranks"])
+            keywords += result["keywords"]
+
+    return {
+        "keywords": merge_keywords(keywords),
+        "sentences": [
+            [sentence, ranks.get(i, 0), start, end]
+            for i, (sentence, start, end) in enumerate(sentences)
+        ],
+    }
+
+
+async def stream_analysis(text, client=None, chunk_tokens=None):
+    """
+    Streaming form of generate_indexed_analysis: the sentence groups are
+    answered concurrently, and ("keywords", keyword) and ("sentences",
+    [sentence, rank, start, end]) are yielded as soon as an entry of any
+    answer is fully received. Keywords are not repeated and sentences the
+    model skipped are not yielded.
+    """
+    client = client or get_llm_client("gemini", "gemini-1.5-pro")
+    chunk_tokens = chunk_tokens or Config.LLM_CHUNK_TOKENS
+    semaphore = asyncio.Semaphore(Config.LLM_CONCURRENCY)
+
+    sentences = await asyncio.to_thread(split_sentences, text)
+
+    entries = asyncio.Queue()
+    keywords, ranked = set(), set()
+
+    async def stream_group(first_index, group):
+        parser = AnalysisStreamParser()
+
+        async for chunk in client.stream(indexed_prompt(first_index, group)):
+            for key, value in parser.feed(chunk):
+                if key == "keywords" and isinstance(value, str):
+                    if value not in keywords:
+                        keywords.add(value)
+                        entries.put_nowait(("keywords", value))
+                elif key == "ranks":
+                    ranks = parse_indexed_ranks(
+                        {"ranks": [value]}, first_index, len(group)
+                    )
+                    for index, rank in ranks.items():
+                        # a retried group does not repeat what was sent
+                        if index not in ranked:
+                            ranked.add(index)
+                            sentence, start, end = sentences[index]
+                            entries.put_nowait(
+                                ("sentences", [sentence, rank, start, end])
+                            )
+
+        if not any(first_index + i in ranked for i in range(len(group))):
+            raise UnparsableAnswer(parser.buffer[:100])
+
+        return True
+
+    async def stream_groups():
+        try:
+            await asyncio.gather(
+                *[
+                    _analyze_with_retries(
+                        lambda first=first, group=group: stream_group(first, group),
+                        client,
+                        semaphore,
+                    )
+                    for first, group in indexed_groups(
+                        [sentence for sentence, _, _ in sentences], chunk_tokens
+                    )
+                ]
+            )
+        finally:
+            entries.put_nowait(None)
+
+    task = asyncio.ensure_future(stream_groups())
+
+    try:
+        while True:
+            entry = await entries.get()
+            if entry is None:
+                break
+
+            yield entry
+
+        # errors that are not retried end the stream with the error
+        await task
+    finally:
+        task.cancel()
@@ -0,0 +1,243 @@
+# text_analysis_test.py
+
+import os
+import sys
+import asyncio
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.embeddings import GeminiEmbeddingProvider
+from services.gemini import get_gemini_async_client
+from services.text_analysis import (
+    AnalysisStreamParser,
+    GeminiClient,
+    LLMClient,
+    generate_indexed_analysis,
+    indexed_groups,
+    merge_keywords,
+    parse_analysis,
+    parse_indexed_ranks,
+    stream_analysis,
+)
+
+
+class FakeClient(LLMClient):
+    def __init__(self, answer, delay=0.0, timeout=1):
+        super().__init__(timeout)
+        self.answer = answer
+        self.delay = delay
+
+    async def _generate(self, prompt, **options):
+        await asyncio.sleep(self.delay)
+        return self.answer
+
+
+class TestParseAnalysis(unittest.TestCase):
+    def test_strips_code_fences(self):
+        raw = '```python\n{"keywords": ["art"], "sentences": [["Art.", 5]]}\n```'
+
+        self.assertEqual(
+            parse_analysis(raw), {"keywords": ["art"], "sentences": [["Art.", 5]]}
+        )
+
+    def test_unparsable_output_is_empty(self):
+        self.assertEqual(
+            parse_analysis('{"keywords": ['), {"keywords": [], "sentences": []}
+        )
+
+
+class TestLLMClient(unittest.TestCase):
+    def test_generate_times_out(self):
+        client = FakeClient("{}", delay=1)
+
+        with self.assertRaises(asyncio.TimeoutError):
+            asyncio.run(client.generate("prompt", timeout=0.01))
+
+    def test_concurrent_calls_do_not_block_each_other(self):
+        client = FakeClient('{"keywords": [], "sentences": []}', delay=0.2)
+
+        async def run():
+            loop = asyncio.get_running_loop()
+            started = loop.time()
+            await asyncio.gather(*[client.generate("prompt") for _ in range(5)])
+            return loop.time() - started
+
+        self.assertLess(asyncio.run(run()), 0.5)
+
+
+class TestGeminiKeys(unittest.TestCase):
+    def test_llm_and_embeddings_keep_their_own_key(self):
+        async def clients():
+            llm = GeminiClient(api_key="llm-key")
+            embeddings = GeminiEmbeddingProvider(api_key="embedding-key")
+
+            with mock.patch("google.generativeai.embed_content_async") as embed:
+                embed.return_value = {"embedding": []}
+                await embeddings.embed_async(["a"])
+
+            self.assertIs(llm.model._async_client, get_gemini_async_client("llm-key"))
+            self.assertIs(
+                embed.call_args.kwargs["client"],
+                get_gemini_async_client("embedding-key"),
+            )
+            self.assertIsNot(
+                get_gemini_async_client("llm-key"),
+                get_gemini_async_client("embedding-key"),
+            )
+
+        asyncio.run(clients())
+
+
+class TestMergeKeywords(unittest.TestCase):
+    def test_merge_dedupes_and_sorts_keywords(self):
+        merged = merge_keywords(["cell", "Biology", "biology", "cell"])
+
+        self.assertEqual(merged, ["Biology", "biology", "cell"])
+
+
+class IndexClient(LLMClient):
+    """Answers with a rank for every numbered sentence of the prompt"""
+
+    def __init__(self):
+        super().__init__(timeout=1)
+
+    async def _generate(self, prompt, **options):
+        lines = prompt.split("**Sentences to rank**:")[1].strip().splitlines()
+        indices = [int(line.split(":")[0]) for line in lines]
+
+        return repr({"keywords": ["art"], "ranks": [[i, 5 - i] for i in indices]})
+
+
+class FlakyIndexClient(IndexClient):
+    """IndexClient whose first answer cannot be parsed"""
+
+    def __init__(self):
+        super().__init__()
+        self.calls = 0
+
+    async def _generate(self, prompt, **options):
+        self.calls += 1
+        if self.calls == 1:
+            return "not a dictionary"
+
+        return await super()._generate(prompt, **options)
+
+
+class TestIndexedAnalysis(unittest.TestCase):
+    def test_parse_keeps_valid_pairs_only(self):
+        result = {"ranks": [[2, 9], [3, 0], [7, 4], ["x", 1], [4]]}
+
+        self.assertEqual(parse_indexed_ranks(result, 2, 3), {2: 5, 3: 1})
+
+    def test_groups_respect_the_budget(self):
+        groups = indexed_groups(["a" * 40] * 5, max_tokens=25)
+
+        self.assertEqual([first for first, _ in groups], [0, 2, 4])
+        self.assertEqual([len(group) for _, group in groups], [2, 2, 1])
+
+    def test_maps_indices_back_to_sentences_and_offsets(self):
+        text = "Art is expression. It is made by people.\n\nArt has history."
+
+        result = asyncio.run(generate_indexed_analysis(text, IndexClient(), 5))
+
+        self.assertEqual([rank for _, rank, _, _ in result["sentences"]], [5, 4, 3])
+        for sentence, _, start, end in result["sentences"]:
+            self.assertEqual(text[start:end], sentence)
+
+    def test_failed_group_is_retried_alone(self):
+        text = " ".join(f"Word{i} is the topic of sentence {i}." for i in range(6))
+        client = FlakyIndexClient()
+
+        with mock.patch("config.Config.LLM_CONCURRENCY", 1), mock.patch(
+            "services.batching.random.uniform", return_value=0
+        ):
+            result = asyncio.run(generate_indexed_analysis(text, client, 10))
+
+        # one group per sentence, the first one answered twice; no sentence
+        # is left unranked (0)
+        self.assertEqual(
+            [rank for _, rank, _, _ in result["sentences"]], [5, 4, 3, 2, 1, 1]
+        )
+        self.assertEqual(client.calls, 7)
+
+    def test_other_errors_are_not_retried(self):
+        client = FlakyIndexClient()
+
+        async def rejected(prompt, **options):
+            client.calls += 1
+            raise PermissionError("API key not valid")
+
+        client._generate = rejected
+
+        with self.assertRaises(PermissionError):
+            asyncio.run(generate_indexed_analysis("Art is expression.", client))
+        self.assertEqual(client.calls, 1)
+
+
+TRUNCATED_ANSWER = """Here's the analysis:
+```python
+{
+    "keywords": ["art", 'Collingwood'],
+    "sentences": [
+        ["What is art? It's [really] \\"hard\\".", 5],
+        ['A question of this kind.', 2],
+        ["Cut off in the mid"""
+
+
+class StreamingIndexClient(IndexClient):
+    """IndexClient that streams its answer a few characters at a time"""
+
+    def __init__(self, step=7):
+        super().__init__()
+        self.prompts = []
+        self.step = step
+
+    async def _stream(self, prompt, **options):
+        self.prompts.append(prompt)
+        answer = await self._generate(prompt)
+
+        for i in range(0, len(answer), self.step):
+            yield answer[i : i + self.step]
+
+
+class TestStreamingParse(unittest.TestCase):
+    def test_entries_arrive_before_the_answer_ends(self):
+        parser = AnalysisStreamParser()
+
+        first = parser.feed('{"keywords": ["art", "hist')
+        second = parser.feed('ory"], "sentences": [["A.", ')
+        third = parser.feed("3]")
+
+        self.assertEqual(first, [("keywords", "art")])
+        self.assertEqual(second, [("keywords", "history")])
+        self.assertEqual(third, [("sentences", ["A.", 3])])
+
+    def test_stream_yields_indexed_groups(self):
+        text = " ".join(f"Word{i} is the topic of sentence {i}." for i in range(4))
+        client = StreamingIndexClient()
+
+        async def run():
+            return [entry async for entry in stream_analysis(text, client, 10)]
+
+        entries = asyncio.run(run())
+
+        # one prompt per group, keywords are sent once
+        self.assertEqual(len(client.prompts), 4)
+        self.assertEqual(entries.count(("keywords", "art")), 1)
+
+        sentences = sorted(value for key, value in entries if key == "sentences")
+        self.assertEqual([rank for _, rank, _, _ in sentences], [5, 4, 3, 2])
+        for sentence, _, start, end in sentences:
+            self.assertEqual(text[start:end], sentence)
+
+    def test_truncated_answer_keeps_complete_entries(self):
+        result = parse_analysis(TRUNCATED_ANSWER)
+
+        self.assertEqual(result["keywords"], ["art", "Collingwood"])
+        self.assertEqual(len(result["sentences"]), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,49 +1,183 @@
-from flask import Blueprint, request, jsonify
+from quart import request, jsonify
+from quart.utils import run_sync
 
 import firebase_admin
 from firebase_admin import credentials, auth
+from firebase_admin._token_gen import ID_TOKEN_CERT_URI
+
+from services.caching import LRUCache
+from services.rate_limiting import client_address, rate_limiter
+from config import Config
 
 from functools import wraps
 
 import os
+import re
+import time
+import hashlib
 import asyncio
 
 cred = credentials.Certificate("utils/firebaseAccountKey.json")
 firebase_admin.initialize_app(cred)
 
+# verified claims by token digest, each entry expires with its token
+_verified_tokens = LRUCache(Config.AUTH_CACHE_SIZE)
 
-def authorization_required():
+_auth_metrics = {
+    "cache_hits": 0,
+    "verifications": 0,
+    "failures": 0,
+    "verify_seconds": 0.0,
+}
+
+# refetch interval used when the cert response has no usable max-age
+CERT_RETRY_SECONDS = 60
+
+_cert_prefetch_task = None
+
+
+def _token_digest(token):
+    # the raw token is a credential, keep only its digest in memory
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+
+async def verify_token(token):
+    """
+    Verified claims of a Firebase ID token. A token seen before is served
+    from memory until its exp; new ones are verified in a thread.
+    """
+    key = _token_digest(token)
+
+    claims = _verified_tokens.get(key)
+    if claims is not None and claims["exp"] > time.time():
+        _auth_metrics["cache_hits"] += 1
+        return claims
+
+    started = time.perf_counter()
+    try:
+        claims = await asyncio.to_thread(auth.verify_id_token, token)
+    except Exception:
+        _auth_metrics["failures"] += 1
+        raise
+    finally:
+        _auth_metrics["verifications"] += 1
+        _auth_metrics["verify_seconds"] += time.perf_counter() - started
+
+    ttl = claims["exp"] - time.time()
+    if ttl > 0:
+        _verified_tokens.set(key, claims, ttl=ttl)
+
+    return claims
+
+
+def auth_stats():
+    lookups = _auth_metrics["cache_hits"] + _auth_metrics["verifications"]
+    verifications = _auth_metrics["verifications"]
+
+    return {
+        "cache_hits": _auth_metrics["cache_hits"],
+        "verifications": verifications,
+        "failures": _auth_metrics["failures"],
+        "hit_rate": _auth_metrics["cache_hits"] / lookups if lookups else 0.0,
+        "avg_verify_ms": (
+            _auth_metrics["verify_seconds"] * 1000 / verifications
+            if verifications
+            else 0.0
+        ),
+        "size": len(_verified_tokens),
+    }
+
+
+def _refresh_certificates():
+    """
+    Refetches the Google signing certs into the HTTP cache that
+    verify_id_token reads them from. Returns their max-age in seconds.
+    """
+    # firebase_admin keeps its cert cache on the auth client's verifier
+    fetch = auth._get_client(None)._token_verifier.request
+
+    # no-cache skips the cached copy, the fresh response is cached again
+    response = fetch(ID_TOKEN_CERT_URI, headers={"Cache-Control": "no-cache"})
+
+    match = re.search(r"max-age=(\d+)", response.headers.get("Cache-Control", ""))
+
+    return int(match.group(1)) if match else None
+
+
+async def _prefetch_certificates():
+    while True:
+        try:
+            max_age = await asyncio.to_thread(_refresh_certificates)
+        except Exception as e:
+            print(e)
+            max_age = None
+
+        if max_age is None:
+            delay = CERT_RETRY_SECONDS
+        else:
+            delay = max(max_age - Config.AUTH_CERT_REFRESH_MARGIN, CERT_RETRY_SECONDS)
+
+        await asyncio.sleep(delay)
 
-    def decorator(func):
-        @wraps(func)
-        def wrapper(*args, **kwargs):
-            if "Authorization" not in request.headers:
-                return jsonify({"error": "Unauthorized"}), 401
 
-            bearer_secret = request.headers.get("Authorization").split(" ")
+async def start_certificate_prefetch():
+    # called at app startup so no request waits on a cert fetch
+    global _cert_prefetch_task
 
-            if len(bearer_secret) != 2:
-                return jsonify({"error": "Unauthorized"}), 401
+    _cert_prefetch_task = asyncio.ensure_future(_prefetch_certificates())
 
-            secret = bearer_secret[1]
 
-            request_body = request.get_json()
+async def stop_certificate_prefetch():
+    global _cert_prefetch_task
 
-            if not request_body:
-                return jsonify({"error": "Unauthorized"}), 401
+    if _cert_prefetch_task is not None:
+        _cert_prefetch_task.cancel()
+        _cert_prefetch_task = None
 
-            if "uid" not in request_body:
-                return jsonify({"error": "Unauthorized"}), 401
 
-            try:
-                decoded_token = auth.verify_id_token(secret)
-                uid = decoded_token["uid"]
-                if uid != request_body["uid"]:
-                    return jsonify({"error": "Unauthorized"}), 401
-            except:
-                return jsonify({"error": "Unauthorized"}), 401
+async def _authorization_error():
+    # returns an error response when the request is not authorized, else None
+    if "Authorization" not in request.headers:
+        return jsonify({"error": "Unauthorized"}), 401
 
-            return func(*args, **kwargs)
+    bearer_secret = request.headers.get("Authorization").split(" ")
+
+    if len(bearer_secret) != 2:
+        return jsonify({"error": "Unauthorized"}), 401
+
+    secret = bearer_secret[1]
+
+    request_body = await request.get_json()
+
+    if not request_body:
+        return jsonify({"error": "Unauthorized"}), 401
+
+    if "uid" not in request_body:
+        return jsonify({"error": "Unauthorized"}), 401
+
+    try:
+        decoded_token = await verify_token(secret)
+        uid = decoded_token["uid"]
+        if uid != request_body["uid"]:
+            return jsonify({"error": "Unauthorized"}), 401
+    except Exception as e:
+        print(e)
+        return jsonify({"error": "Unauthorized"}), 401
+
+    return None
+
+
+def authorization_required():
+
+    def decorator(func):
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            error = await _authorization_error()
+            if error is not None:
+                return error
+
+            # sync views run in quart's thread pool
+            return await run_sync(func)(*args, **kwargs)
 
         return wrapper
 
@@ -55,32 +189,58 @@ def async_authorization_required():
     def decorator(func):
         @wraps(func)
         async def wrapper(*args, **kwargs):
-            if "Authorization" not in request.headers:
-                return jsonify({"error": "Unauthorized"}), 401
+            error = await _authorization_error()
+            if error is not None:
+                return error
+
+            return await func(*args, **kwargs)
+
+        return wrapper
 
-            bearer_secret = request.headers.get("Authorization").split(" ")
+    return decorator
+
+
+async def _rate_limit_identity():
+    # verified users are limited by uid, anonymous callers by address
+    bearer_secret = request.headers.get("Authorization", "").split(" ")
 
-            if len(bearer_secret) != 2:
-                return jsonify({"error": "Unauthorized"}), 401
+    if len(bearer_secret) == 2:
+        try:
+            return "uid:" + (await verify_token(bearer_secret[1]))["uid"]
+        except Exception:
+            pass
 
-            secret = bearer_secret[1]
+    address = client_address(
+        request.headers.get("X-Forwarded-For"), request.remote_addr
+    )
 
-            request_body = request.get_json()
+    return f"ip:{address}"
 
-            if not request_body:
-                return jsonify({"error": "Unauthorized"}), 401
 
-            if "uid" not in request_body:
-                return jsonify({"error": "Unauthorized"}), 401
+def rate_limited(cost):
+    """
+    Charges cost(request_body) units of the caller's shared rate limit before
+    the view runs, answering 429 with Retry-After once it is used up.
+    """
 
-            try:
-                decoded_token = await asyncio.to_thread(auth.verify_id_token, secret)
-                uid = decoded_token["uid"]
-                if uid != request_body["uid"]:
-                    return jsonify({"error": "Unauthorized"}), 401
-            except Exception as e:
-                print(e)
-                return jsonify({"error": "Unauthorized"}), 401
+    def decorator(func):
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            # the cost functions read fields of an object, whatever was sent
+            request_body = await request.get_json(silent=True)
+            if not isinstance(request_body, dict):
+                request_body = {}
+
+            allowed, remaining, retry_after = await rate_limiter.hit(
+                await _rate_limit_identity(), cost(request_body)
+            )
+
+            if not allowed:
+                return (
+                    jsonify({"error": "Rate limit exceeded"}),
+                    429,
+                    {"Retry-After": str(retry_after)},
+                )
 
             return await func(*args, **kwargs)
 
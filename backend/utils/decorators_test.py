@@ -0,0 +1,145 @@
+# decorators_test.py
+
+import os
+import sys
+import time
+import asyncio
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import Config
+from utils import decorators
+from utils.decorators import (
+    CERT_RETRY_SECONDS,
+    start_certificate_prefetch,
+    stop_certificate_prefetch,
+    verify_token,
+)
+
+
+class TestVerifyToken(unittest.TestCase):
+    def setUp(self):
+        self.calls = []
+        self.lifetime = 3600
+
+        def verify_id_token(token):
+            self.calls.append(token)
+            if token == "forged":
+                raise ValueError("invalid signature")
+
+            return {"uid": "u", "exp": time.time() + self.lifetime}
+
+        patcher = mock.patch(
+            "utils.decorators.auth.verify_id_token", side_effect=verify_id_token
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        patcher = mock.patch(
+            "utils.decorators._verified_tokens", decorators.LRUCache(10)
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def verify(self, token):
+        return asyncio.run(verify_token(token))
+
+    def test_token_is_verified_once_until_it_expires(self):
+        self.assertEqual(self.verify("token")["uid"], "u")
+        self.assertEqual(self.verify("token")["uid"], "u")
+
+        self.assertEqual(self.calls, ["token"])
+
+    def test_expired_token_is_verified_again(self):
+        self.lifetime = 0.05
+        self.verify("token")
+        time.sleep(0.1)
+        self.verify("token")
+
+        self.assertEqual(self.calls, ["token", "token"])
+
+    def test_token_past_its_exp_is_not_cached(self):
+        self.lifetime = -1
+        self.verify("token")
+        self.verify("token")
+
+        self.assertEqual(len(self.calls), 2)
+
+    def test_failures_are_not_cached(self):
+        for _ in range(2):
+            with self.assertRaises(ValueError):
+                self.verify("forged")
+
+        self.assertEqual(len(self.calls), 2)
+
+    def test_only_a_digest_of_the_token_is_kept(self):
+        self.verify("token")
+
+        self.assertIsNone(decorators._verified_tokens.get("token"))
+        self.assertEqual(len(decorators._verified_tokens), 1)
+
+
+class TestCertificatePrefetch(unittest.TestCase):
+    def run_prefetch(self, max_ages):
+        """Delays the prefetch loop sleeps for, one per refresh in max_ages"""
+        delays = []
+        refreshes = iter(max_ages)
+
+        def refresh():
+            max_age = next(refreshes)
+            if isinstance(max_age, Exception):
+                raise max_age
+
+            return max_age
+
+        async def sleep(delay):
+            delays.append(delay)
+            if len(delays) == len(max_ages):
+                raise asyncio.CancelledError
+
+        async def run():
+            with mock.patch(
+                "utils.decorators._refresh_certificates", refresh
+            ), mock.patch("utils.decorators.asyncio.sleep", sleep):
+                with self.assertRaises(asyncio.CancelledError):
+                    await decorators._prefetch_certificates()
+
+        asyncio.run(run())
+
+        return delays
+
+    def test_refetches_before_the_certs_expire(self):
+        delays = self.run_prefetch([21600, 3600])
+
+        margin = Config.AUTH_CERT_REFRESH_MARGIN
+        self.assertEqual(delays, [21600 - margin, 3600 - margin])
+
+    def test_short_or_missing_max_age_waits_the_retry_interval(self):
+        delays = self.run_prefetch([10, None, RuntimeError("certs unreachable")])
+
+        self.assertEqual(delays, [CERT_RETRY_SECONDS] * 3)
+
+    def test_start_and_stop(self):
+        async def run():
+            with mock.patch(
+                "utils.decorators._refresh_certificates", return_value=3600
+            ):
+                await start_certificate_prefetch()
+                task = decorators._cert_prefetch_task
+                await asyncio.sleep(0.01)
+
+                self.assertFalse(task.done())
+
+                await stop_certificate_prefetch()
+                await asyncio.sleep(0)
+
+                self.assertTrue(task.cancelled())
+                self.assertIsNone(decorators._cert_prefetch_task)
+
+        asyncio.run(run())
+
+
+if __name__ == "__main__":
+    unittest.main()
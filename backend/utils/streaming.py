@@ -0,0 +1,29 @@
+import json
+
+from quart import Response
+
+
+def ndjson_response(async_iterable):
+    """Streams the dicts produced by an async generator as newline-delimited JSON"""
+
+    async def generate():
+        async for message in async_iterable:
+            yield json.dumps(message) + "\n"
+
+    return Response(generate(), mimetype="application/x-ndjson")
+
+
+def json_array_response(async_iterable):
+    """Streams the items of an async iterable as one JSON array"""
+
+    async def generate():
+        yield "["
+
+        separator = ""
+        async for item in async_iterable:
+            yield separator + json.dumps(item, default=str)
+            separator = ","
+
+        yield "]"
+
+    return Response(generate(), mimetype="application/json")
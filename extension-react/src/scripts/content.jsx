@@ -265,7 +265,8 @@ chrome.runtime.onMessage.addListener((request, sender, sendResponse) => {
                         "text": textContent,
                         "uid" : uid,
                         "url" : currentUrl,
-                        "ranking": 3
+                        "ranking": 3,
+                        "keywords": true
                      })
                 });
                 // Check if response is not OK